@@ -1,53 +1,149 @@
 import streamlit as st
-from utils import format_balance, format_supply, format_nft_metadata
-from moralis import evm_api
+from utils import format_balance, format_supply, format_nft_metadata, format_pnl_summary, format_pnl_breakdown
 from cachetools import TTLCache, cached
+from contextlib import contextmanager
+import inspect
+import threading
 import time
-from moralis_api import get_api_key, get_native_balance, get_token_balances, \
+from moralis_api import fetch_key, load_config, get_api_key, get_native_balance, get_token_balances, \
     get_wallet_transactions, get_nft_transfers, get_nfts, \
     get_erc20_token_transfers, get_wallet_net_worth, get_wallet_pnl, get_wallet_pnl_breakdown
-# Cache for Moralis API responses with a TTL of 1 minute (60 seconds)
-moralis_cache = TTLCache(maxsize=100, ttl=60)
+from resilience import payload_age
+from fetch_queue import JobQueue, QUEUE_PATH
+from flow_graph import FlowGraph
 
-@cached(moralis_cache)
-def get_cached_token_balances(address, chain, api_key):
+PENDING_POLL_SECONDS = 1  # wait between reruns while sections wait on the fetch workers
+PRICE_MAX_AGE = 3600      # a transfer is valued with a price fetched up to an hour before it
+
+# Cache for Moralis API responses with a TTL of 1 minute (60 seconds).
+# Streamlit re-executes this script on every rerun, so the cache is kept as a
+# process-wide resource instead of being rebuilt, and shared by all sessions.
+@st.cache_resource
+def get_response_cache():
+    return TTLCache(maxsize=100, ttl=60), threading.RLock()
+
+moralis_cache, moralis_cache_lock = get_response_cache()
+
+@st.cache_resource
+def get_job_queue():
+    # Set use_workers = true under [fetch] in config.ini to hand fetches to fetch_worker.py processes
+    config = load_config()
+    if not config.getboolean("fetch", "use_workers", fallback=False):
+        return None
+    return JobQueue(config.get("fetch", "queue_path", fallback=QUEUE_PATH))
+
+def job_arguments(fetcher, address, chain, api_key, *args, **kwargs):
+    # Spell out every optional argument by name, so equal fetches always map to the same job
+    bound = inspect.signature(fetcher).bind(address, chain, api_key, *args, **kwargs)
+    bound.apply_defaults()
+    # The first three parameters are sent positionally, whatever the fetcher calls them
+    return dict(list(bound.arguments.items())[3:])
+
+class FetchPending(Exception):
+    """Raised while a fetch job is still with the workers; cached() never stores it, so the next rerun asks again."""
+
+def run_fetch(fetcher, address, chain, api_key, *args, **kwargs):
+    """Runs a fetcher inline, or hands it to the fetch workers without waiting for it.
+
+    With workers, the job is submitted once per session and its status checked on
+    each rerun; FetchPending is raised until it is done. A failed job returns None.
+    """
+    job_queue = get_job_queue()
+    if job_queue is None:
+        return fetcher(address, chain, api_key, *args, **kwargs)
+    job_kwargs = job_arguments(fetcher, address, chain, api_key, *args, **kwargs)
+    job_id = job_queue.job_id(fetcher.__name__, (address, chain), job_kwargs)
+    submitted = st.session_state.setdefault("submitted_jobs", set())
+    if job_id not in submitted:
+        job_queue.submit(fetcher.__name__, address, chain, **job_kwargs)
+        submitted.add(job_id)
+
+    job = job_queue.status(job_id)
+    if job is not None and job["status"] in ("queued", "running"):
+        raise FetchPending(job_id)
+    submitted.discard(job_id)
+    if job is None or job["status"] == "failed":
+        print(f"Fetch job {job_id} failed: {job and job['error']}")
+        return None
+    return job["result"]
+
+def fetch_button(label):
+    # A section whose fetch is still with the workers is shown again on the reruns that poll for it
+    return st.button(label) or label in st.session_state.get("pending_sections", set())
+
+@contextmanager
+def awaiting_workers(label):
+    pending = st.session_state.setdefault("pending_sections", set())
+    pending.discard(label)
+    try:
+        yield
+    except FetchPending:
+        pending.add(label)
+        st.info("Queued for the fetch workers; this section fills in when they are done.")
+
+@cached(moralis_cache, key=fetch_key("get_cached_token_balances"), lock=moralis_cache_lock)
+def get_cached_token_balances(address, chain, api_key, exclude_spam=True, exclude_unverified_contracts=False, min_usd_value=0):
     print("Fetching token balances from API (not cached)")
-    return get_token_balances(address, chain, api_key)
+    return run_fetch(get_token_balances, address, chain, api_key, exclude_spam, exclude_unverified_contracts, min_usd_value)
 
-@cached(moralis_cache)
+@cached(moralis_cache, key=fetch_key("get_cached_wallet_transactions"), lock=moralis_cache_lock)
 def get_cached_wallet_transactions(address, chain, api_key, from_block=None, to_block=None, from_date=None, to_date=None):
     print("Fetching wallet transactions from API (not cached)")
-    return get_wallet_transactions(address, chain, api_key, from_block, to_block, from_date, to_date)
+    return run_fetch(get_wallet_transactions, address, chain, api_key, from_block, to_block, from_date, to_date)
 
-@cached(moralis_cache)
-def get_cached_nft_transfers(address, chain, api_key):
+@cached(moralis_cache, key=fetch_key("get_cached_nft_transfers"), lock=moralis_cache_lock)
+def get_cached_nft_transfers(address, chain, api_key, exclude_spam=True, exclude_unverified_contracts=False):
     print("Fetching NFT transfers from API (not cached)")
-    return get_nft_transfers(address, chain, api_key)
+    return run_fetch(get_nft_transfers, address, chain, api_key, exclude_spam, exclude_unverified_contracts)
 
-@cached(moralis_cache)
-def get_cached_nfts(address, chain, api_key):
+@cached(moralis_cache, key=fetch_key("get_cached_nfts"), lock=moralis_cache_lock)
+def get_cached_nfts(address, chain, api_key, exclude_spam=True, exclude_unverified_contracts=False):
     print("Fetching NFTs from API (not cached)")
-    return get_nfts(address, chain, api_key)
+    return run_fetch(get_nfts, address, chain, api_key, exclude_spam, exclude_unverified_contracts)
 
-@cached(moralis_cache)
-def get_cached_erc20_token_transfers(address, chain, api_key):
+@cached(moralis_cache, key=fetch_key("get_cached_erc20_token_transfers"), lock=moralis_cache_lock)
+def get_cached_erc20_token_transfers(address, chain, api_key, exclude_spam=True, exclude_unverified_contracts=False):
     print("Fetching ERC20 token transfers from API (not cached)")
-    return get_erc20_token_transfers(address, chain, api_key)
+    return run_fetch(get_erc20_token_transfers, address, chain, api_key, exclude_spam, exclude_unverified_contracts)
 
-@cached(moralis_cache)
+@cached(moralis_cache, key=fetch_key("get_cached_wallet_net_worth"), lock=moralis_cache_lock)
 def get_cached_wallet_net_worth(address, chain, api_key, exclude_spam=True, exclude_unverified_contracts=True):
     print("Fetching wallet net worth from API (not cached)")
-    return get_wallet_net_worth(address, chain, api_key, exclude_spam, exclude_unverified_contracts)
+    return run_fetch(get_wallet_net_worth, address, chain, api_key, exclude_spam, exclude_unverified_contracts)
 
-@cached(moralis_cache)
+@cached(moralis_cache, key=fetch_key("get_cached_wallet_pnl"), lock=moralis_cache_lock)
 def get_cached_wallet_pnl(address, chain, api_key):
     print("Fetching wallet pnl from API (not cached)")
-    return get_wallet_pnl(address, chain, api_key)
+    return run_fetch(get_wallet_pnl, address, chain, api_key)
 
-@cached(moralis_cache)
+@cached(moralis_cache, key=fetch_key("get_cached_wallet_pnl_breakdown"), lock=moralis_cache_lock)
 def get_cached_wallet_pnl_breakdown(address, chain, api_key):
     print("Fetching wallet pnl BREAKDOWN from API (not cached)")
-    return get_wallet_pnl_breakdown(address, chain, api_key)
+    return run_fetch(get_wallet_pnl_breakdown, address, chain, api_key)
+
+def show_payload_age(fetcher, address, chain, api_key, *args, **kwargs):
+    # Warn when the fetch failed and the last good answer is being shown instead
+    job_queue = get_job_queue()
+    if job_queue is None:
+        age = payload_age(fetcher, address, chain, api_key, *args, **kwargs)
+    else:
+        job_kwargs = job_arguments(fetcher, address, chain, api_key, *args, **kwargs)
+        age = job_queue.payload_age(fetcher.__name__, address, chain, **job_kwargs)
+    if age is not None:
+        shown_age = f"{age:.0f} seconds" if age < 120 else f"{age / 60:.0f} minutes"
+        st.warning(f"Moralis is not responding. Showing data fetched {shown_age} ago.")
+
+@st.cache_resource
+def get_flow_graph(chain, filters, min_value):
+    # One graph per chain, filter settings and process, so transfers ingested by any
+    # session are reused by all, and rows a filter hides never reach another's results
+    return FlowGraph()
+
+@st.cache_resource
+def get_price_history():
+    # pnl_engine pulls in numpy, so it is only imported once prices are needed
+    from pnl_engine import PriceHistory
+    return PriceHistory()
 
 def main():
     st.title("Whale Wallet Explorer")
@@ -74,24 +170,36 @@ def main():
     selected_chain_name = st.selectbox("Select Chain", list(chain_options.keys()))
     chain = chain_options[selected_chain_name]
 
+    # Spam and unverified contracts are dropped while fetching, before anything is cached
+    exclude_spam = st.checkbox("Hide possible spam", value=True)
+    exclude_unverified_contracts = st.checkbox("Hide unverified contracts", value=False)
+    min_value = st.number_input("Hide balances and transfers worth less than (USD)",
+                                min_value=0.0, value=0.0, format="%.2f",
+                                help="Balances use Moralis' USD value. Transfers are valued at the prices fetched so far "
+                                     "for their block time. Anything that cannot be priced is kept.")
+    filters = (exclude_spam, exclude_unverified_contracts)
+
     # Add a button to clear the cache
     if st.button("Clear Cache"):
-        moralis_cache.clear()
+        with moralis_cache_lock:
+            moralis_cache.clear()
         st.success("Cache cleared!")
 
     # Native Balance
-    if st.button("Get Native Balance"):
-        with st.spinner("Fetching native balance..."):
-            native_balance = get_native_balance(wallet_address, chain, api_key)
+    if fetch_button("Get Native Balance"):
+        with st.spinner("Fetching native balance..."), awaiting_workers("Get Native Balance"):
+            native_balance = run_fetch(get_native_balance, wallet_address, chain, api_key)
+            show_payload_age(get_native_balance, wallet_address, chain, api_key)
             if native_balance is not None:
                 st.success(f"Native Balance ({selected_chain_name}): {format_balance(native_balance)}")
             else:
                 st.error(f"Failed to retrieve native balance for {selected_chain_name}.")
 
     # ERC20 Token Balances
-    if st.button("Get ERC20 Token Balances"):
-        with st.spinner("Fetching ERC20 token balances..."):
-            token_balances = get_cached_token_balances(wallet_address, chain, api_key)
+    if fetch_button("Get ERC20 Token Balances"):
+        with st.spinner("Fetching ERC20 token balances..."), awaiting_workers("Get ERC20 Token Balances"):
+            token_balances = get_cached_token_balances(wallet_address, chain, api_key, *filters, min_value)
+            show_payload_age(get_token_balances, wallet_address, chain, api_key, *filters, min_value)
             if token_balances:
                 token_data = []
                 for token in token_balances:
@@ -101,6 +209,7 @@ def main():
                         "Symbol": token["symbol"],
                         "Address": token["address"],
                         "Balance": format_balance(token["balance"]),
+                        "Value (USD)": token.get("usd_value"),
                         "Decimals": token.get("decimals", "N/A"),
                         "Total Supply": format_supply(token.get("total_supply_formatted", "N/A")),
                         "Contract Verified": "✅" if token.get("verified_contract", "N/A") else "❌",
@@ -115,6 +224,7 @@ def main():
                     "Symbol": st.column_config.TextColumn("Symbol"),
                     "Address": st.column_config.TextColumn("Address"),
                     "Balance": st.column_config.NumberColumn("Balance", format="%.4f"),
+                    "Value (USD)": st.column_config.NumberColumn("Value (USD)", format="$%.2f"),
                     "Decimals": st.column_config.NumberColumn("Decimals"),
                     "Total Supply": st.column_config.NumberColumn("Total Supply", format="%.4f"),
                     "Contract Verified": st.column_config.TextColumn("Contract Verified"),
@@ -125,9 +235,10 @@ def main():
                 st.info("No ERC-20 tokens found for this wallet.")
     
     # Wallet Transactions
-    if st.button("Get Wallet Transactions"):
-        with st.spinner("Fetching wallet transactions..."):
+    if fetch_button("Get Wallet Transactions"):
+        with st.spinner("Fetching wallet transactions..."), awaiting_workers("Get Wallet Transactions"):
             transactions = get_cached_wallet_transactions(wallet_address, chain, api_key, from_block=18000000)
+            show_payload_age(get_wallet_transactions, wallet_address, chain, api_key, from_block=18000000)
             if transactions:
                 st.write("Wallet Transactions:")
                 st.dataframe(transactions, use_container_width=True)
@@ -135,9 +246,10 @@ def main():
                 st.info("No wallet transactions found.")
 
     # NFT Transfers
-    if st.button("Get NFT Transfers"):
-        with st.spinner("Fetching NFT transfers..."):
-            nft_transfers = get_cached_nft_transfers(wallet_address, chain, api_key)
+    if fetch_button("Get NFT Transfers"):
+        with st.spinner("Fetching NFT transfers..."), awaiting_workers("Get NFT Transfers"):
+            nft_transfers = get_cached_nft_transfers(wallet_address, chain, api_key, *filters)
+            show_payload_age(get_nft_transfers, wallet_address, chain, api_key, *filters)
             if nft_transfers:
                 st.write("NFT Transfers:")
                 st.dataframe(nft_transfers, use_container_width=True)
@@ -145,9 +257,10 @@ def main():
                 st.info("No NFT transfers found for this wallet.")
     
     # NFTs
-    if st.button("Get NFTs"):
-        with st.spinner("Fetching NFTs..."):
-            nfts = get_cached_nfts(wallet_address, chain, api_key)
+    if fetch_button("Get NFTs"):
+        with st.spinner("Fetching NFTs..."), awaiting_workers("Get NFTs"):
+            nfts = get_cached_nfts(wallet_address, chain, api_key, *filters)
+            show_payload_age(get_nfts, wallet_address, chain, api_key, *filters)
             if nfts:
                 st.write("NFTs:")
                 nfts_data = []
@@ -170,36 +283,43 @@ def main():
                 st.info("No NFTs found for this wallet.")
     
     # ERC20 Token Transfers
-    if st.button("Get ERC20 Token Transfers"):
-        with st.spinner("Fetching ERC20 token transfers..."):
-            erc20_transfers = get_cached_erc20_token_transfers(wallet_address, chain, api_key)
+    if fetch_button("Get ERC20 Token Transfers"):
+        with st.spinner("Fetching ERC20 token transfers..."), awaiting_workers("Get ERC20 Token Transfers"):
+            erc20_transfers = get_cached_erc20_token_transfers(wallet_address, chain, api_key, *filters)
+            show_payload_age(get_erc20_token_transfers, wallet_address, chain, api_key, *filters)
+            if min_value:
+                from pnl_engine import drop_dust
+                erc20_transfers = drop_dust(erc20_transfers, get_price_history(), min_value)
             if erc20_transfers:
                 st.write("ERC20 Token Transfers:")
                 st.dataframe(erc20_transfers, use_container_width=True)
             else:
                 st.info("No ERC20 token transfers found for this wallet.")
 
-    if st.button("Get Wallet Net Worth"):
-        with st.spinner("Fetching wallet net worth..."):
+    if fetch_button("Get Wallet Net Worth"):
+        with st.spinner("Fetching wallet net worth..."), awaiting_workers("Get Wallet Net Worth"):
             net_worth_data = get_cached_wallet_net_worth(wallet_address, chain, api_key)
+            show_payload_age(get_wallet_net_worth, wallet_address, chain, api_key)
             if net_worth_data:
                 st.write("Wallet Net Worth:")
                 st.dataframe(net_worth_data, use_container_width=True)
             else:
                 st.info("Could not retrieve wallet net worth.")
 
-    if st.button("Get Wallet PnL"):
-            with st.spinner("Fetching wallet PnL..."):
+    if fetch_button("Get Wallet PnL"):
+            with st.spinner("Fetching wallet PnL..."), awaiting_workers("Get Wallet PnL"):
                 pnl_data = get_cached_wallet_pnl(wallet_address, chain, api_key)
+                show_payload_age(get_wallet_pnl, wallet_address, chain, api_key)
                 if pnl_data:
                     st.write("Wallet PnL:")
                     st.dataframe(pnl_data, use_container_width=True)
                 else:
                     st.info("Could not retrieve wallet PnL.")
 
-    if st.button("Get Wallet PnL Breakdown"):
-            with st.spinner("Fetching wallet PnL Breakdown..."):
+    if fetch_button("Get Wallet PnL Breakdown"):
+            with st.spinner("Fetching wallet PnL Breakdown..."), awaiting_workers("Get Wallet PnL Breakdown"):
                 pnl_data = get_cached_wallet_pnl_breakdown(wallet_address, chain, api_key)
+                show_payload_age(get_wallet_pnl_breakdown, wallet_address, chain, api_key)
                 if pnl_data and isinstance(pnl_data, list):
                     for token_pnl in pnl_data:
                         st.write(f"Wallet PnL for Token: {token_pnl[0]['Value'] if token_pnl[0]['Metric'] == 'token_address' else 'Unknown'}:")
@@ -207,5 +327,86 @@ def main():
                 else:
                     st.info("Could not retrieve wallet PnL or invalid response format.")
 
+    # Counterparty flows across a watchlist of wallets
+    watchlist_text = st.text_area("Watchlist (one address per line)", wallet_address)
+    watchlist = [line.strip().lower() for line in watchlist_text.splitlines() if line.strip()]
+
+    if fetch_button("Get Counterparty Flows"):
+        with st.spinner("Building counterparty graph..."), awaiting_workers("Get Counterparty Flows"):
+            flow_graph = get_flow_graph(chain, filters, min_value)
+            transfers_by_wallet = {
+                address: get_cached_erc20_token_transfers(address, chain, api_key, *filters) for address in watchlist
+            }
+            from pnl_engine import backfill_prices, drop_dust
+
+            # ERC20 flows are valued at each transfer's block price; native transfers carry no price
+            price_history = get_price_history()
+            backfill_prices(transfers_by_wallet, price_history, chain, api_key, PRICE_MAX_AGE, value_holdings=False,
+                            fetch=run_fetch)
+            for address in watchlist:
+                flow_graph.add_transfers(address, drop_dust(transfers_by_wallet[address], price_history, min_value),
+                                         price_lookup=price_history.price_at)
+                flow_graph.add_transfers(address, get_cached_wallet_transactions(address, chain, api_key, from_block=18000000))
+
+            st.write(f"Graph: {len(flow_graph):,} wallets, {flow_graph.edge_count:,} edges")
+
+            clusters = flow_graph.clusters(watchlist)
+            if clusters:
+                st.write("Wallet Clusters:")
+                st.dataframe([{"Cluster": i + 1, "Size": len(c), "Wallets": ", ".join(c)} for i, c in enumerate(clusters)],
+                             hide_index=True, use_container_width=True)
+
+            shared = flow_graph.shared_counterparties(watchlist)
+            if shared:
+                st.write("Shared Counterparties:")
+                st.dataframe([{
+                    "Counterparty": row["counterparty"],
+                    "Watched Wallets": row["wallet_count"],
+                    "Priced ERC20 Flow (USD)": row["usd"],
+                    "Wallets": ", ".join(row["wallets"]),
+                } for row in shared], hide_index=True, use_container_width=True)
+                st.caption("USD totals cover ERC20 transfers with a known price; native transfers are counted but not valued.")
+            else:
+                st.info("No shared counterparties found among the watchlist wallets.")
+
+            flows = flow_graph.subgraph_edges(watchlist)
+            if flows:
+                st.write("Flows Between Watched Wallets:")
+                st.dataframe([{
+                    **flow,
+                    "tokens": ", ".join(f"{amount:,.4f} {token}" for token, amount in flow["tokens"].items()),
+                } for flow in flows], use_container_width=True)
+
+    # Local FIFO PnL over the watchlist, recomputed from cached transfers and prices
+    pnl_from_date = st.date_input("PnL From Date", value=None)
+    pnl_to_date = st.date_input("PnL To Date", value=None)
+
+    if fetch_button("Get Local PnL"):
+        with st.spinner("Computing local PnL..."), awaiting_workers("Get Local PnL"):
+            from pnl_engine import backfill_prices, compute_wallet_pnl, summarize_pnl
+
+            transfers_by_wallet = {
+                address: get_cached_erc20_token_transfers(address, chain, api_key, *filters) for address in watchlist
+            }
+            # Dust is kept here: dropping small buys would shift the FIFO cost basis of later sells
+            price_history = get_price_history()
+            backfill_prices(transfers_by_wallet, price_history, chain, api_key, PRICE_MAX_AGE, to_date=pnl_to_date,
+                            fetch=run_fetch)
+            wallet_pnl = compute_wallet_pnl(transfers_by_wallet, price_history, pnl_from_date, pnl_to_date)
+            for address, token_pnl in wallet_pnl.items():
+                if not token_pnl:
+                    st.info(f"No ERC20 trades found for {address} in this window.")
+                    continue
+                st.write(f"Local PnL for Wallet: {address}:")
+                st.dataframe(format_pnl_summary(summarize_pnl(token_pnl)), use_container_width=True)
+                for pnl in token_pnl:
+                    st.write(f"Local PnL for Token: {pnl['token_address']}:")
+                    st.dataframe(format_pnl_breakdown(pnl), use_container_width=True)
+
+    # Poll the fetch workers by rerunning while any section is waiting on them
+    if st.session_state.get("pending_sections"):
+        time.sleep(PENDING_POLL_SECONDS)
+        st.rerun()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
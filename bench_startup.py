@@ -0,0 +1,102 @@
+"""Tracks the app's startup cost: module import time, per-rerun time and first-request latency.
+
+Each measurement runs in a fresh interpreter so nothing is already imported.
+
+    python bench_startup.py --runs 5 > bench_output.txt
+
+The request measurements need a Moralis key in config.ini and are skipped without one.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+IMPORT_SNIPPET = """
+import time
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+# Executes app.py the way Streamlit does on each rerun, without a server
+RERUN_SNIPPET = """
+import runpy, time
+start = time.perf_counter()
+app = runpy.run_path("app.py", run_name="__bench__")
+app["main"]()
+print(time.perf_counter() - start)
+for _ in range({reruns}):
+    start = time.perf_counter()
+    app = runpy.run_path("app.py", run_name="__bench__")
+    app["main"]()
+    print(time.perf_counter() - start)
+"""
+
+REQUEST_SNIPPET = """
+import time
+import moralis_api
+start = time.perf_counter()
+api_key = moralis_api.get_api_key()
+if not api_key:
+    raise SystemExit(2)
+for _ in range(2):
+    moralis_api.get_native_balance({address!r}, {chain!r}, api_key)
+    print(time.perf_counter() - start)
+    start = time.perf_counter()
+"""
+
+
+def run_snippet(snippet):
+    """Runs snippet in a new interpreter and returns the timings it printed, or None if it failed."""
+    result = subprocess.run([sys.executable, "-c", snippet], capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    timings = []
+    for line in result.stdout.splitlines():
+        try:
+            timings.append(float(line))
+        except ValueError:
+            continue
+    return timings
+
+def report(name, samples):
+    if not samples:
+        print(f"{name:<40} skipped")
+        return
+    print(f"{name:<40} median {statistics.median(samples) * 1000:9.1f} ms   min {min(samples) * 1000:9.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app import time, rerun time and first-request latency.")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--address", default="0x00000000219ab540356cbb839cbe05303d7705fa")
+    parser.add_argument("--chain", default="0x1")
+    args = parser.parse_args()
+
+    for module in ("moralis_api", "moralis.evm_api", "streamlit", "app"):
+        samples = []
+        for _ in range(args.runs):
+            timings = run_snippet(IMPORT_SNIPPET.format(module=module))
+            if timings:
+                samples.append(timings[-1])
+        report(f"import {module}", samples)
+
+    first_runs, reruns = [], []
+    for _ in range(args.runs):
+        timings = run_snippet(RERUN_SNIPPET.format(reruns=3))
+        if timings:
+            first_runs.append(timings[0])
+            reruns.extend(timings[1:])
+    report("first app run", first_runs)
+    report("app rerun", reruns)
+
+    first_requests, warm_requests = [], []
+    for _ in range(args.runs):
+        timings = run_snippet(REQUEST_SNIPPET.format(address=args.address, chain=args.chain))
+        if timings:
+            first_requests.append(timings[0])
+            warm_requests.append(timings[1])
+    report("first request (incl. config and SDK load)", first_requests)
+    report("warm request", warm_requests)
+
+if __name__ == "__main__":
+    main()
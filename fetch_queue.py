@@ -0,0 +1,173 @@
+import hashlib
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+
+QUEUE_PATH = "fetch_queue.sqlite3"
+RESULT_TTL = 60        # seconds a finished job's result is reused, same as moralis_cache
+LEASE_SECONDS = 120    # a running job whose worker went quiet this long is handed to another worker
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 0.25
+
+
+class JobQueue:
+    """Fetch jobs and their results in a local SQLite file, shared by the app and fetch workers.
+
+    A job is identified by its fetcher name and arguments, so submitting the same
+    fetch again while it is queued, running or freshly done reuses the one job.
+    Finished results stay in the table for RESULT_TTL seconds, which makes it the
+    result cache shared by every UI process and worker.
+    """
+
+    def __init__(self, path=QUEUE_PATH):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    fetcher TEXT NOT NULL,
+                    args TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    leased_until REAL,
+                    fetched_at REAL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per operation, so any thread or process can use the queue
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def job_id(fetcher, args, kwargs):
+        payload = json.dumps([fetcher, list(args), kwargs], sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def submit(self, fetcher, *args, **kwargs):
+        """Queues fetcher(address, chain, api_key, ...) without the api_key, which workers supply. Returns the job id."""
+        job_id = self.job_id(fetcher, args, kwargs)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO jobs (id, fetcher, args, status, created_at, updated_at)
+                VALUES (?, ?, ?, 'queued', ?, ?)
+                ON CONFLICT (id) DO UPDATE SET
+                    status = 'queued', result = NULL, error = NULL, attempts = 0,
+                    created_at = excluded.created_at, updated_at = excluded.updated_at
+                WHERE status = 'failed' OR (status = 'done' AND updated_at < ?)
+                """,
+                (job_id, fetcher, json.dumps({"args": list(args), "kwargs": kwargs}, default=str), now, now, now - RESULT_TTL),
+            )
+        return job_id
+
+    def status(self, job_id):
+        """Returns the job's row as a dict with its result decoded, or None for an unknown job."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+    def wait(self, job_id, timeout=60, poll_interval=POLL_INTERVAL):
+        """Polls until the job is done or failed and returns its result, or None on failure or timeout."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = self.status(job_id)
+            if job is None or job["status"] == "failed":
+                return None
+            if job["status"] == "done":
+                return job["result"]
+            time.sleep(poll_interval)
+        print(f"Timed out waiting for fetch job {job_id}")
+        return None
+
+    def claim(self):
+        """Leases the oldest queued job, or a running one whose lease expired, to the calling worker.
+
+        A job whose lease expired after its last allowed attempt is marked failed
+        instead, so a job that crashes or hangs its worker is not retried forever.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                """
+                UPDATE jobs SET status = 'failed', error = 'Worker lease expired', updated_at = ?, leased_until = NULL
+                WHERE status = 'running' AND leased_until < ? AND attempts >= ?
+                """,
+                (now, now, MAX_ATTEMPTS),
+            )
+            row = conn.execute(
+                """
+                SELECT * FROM jobs
+                WHERE status = 'queued' OR (status = 'running' AND leased_until < ?)
+                ORDER BY created_at LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, leased_until = ?, updated_at = ? WHERE id = ?",
+                (now + LEASE_SECONDS, now, row["id"]),
+            )
+            conn.execute("COMMIT")
+        job = dict(row)
+        job.update(json.loads(job["args"]))
+        job["attempts"] += 1
+        return job
+
+    def complete(self, job_id, result, fetched_at=None):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, updated_at = ?, fetched_at = ?, leased_until = NULL WHERE id = ?",
+                (json.dumps(result, default=str), now, fetched_at or now, job_id),
+            )
+
+    def fail(self, job_id, error):
+        """Puts the job back in the queue, or marks it failed once it has used MAX_ATTEMPTS."""
+        with self._connect() as conn:
+            conn.execute(
+                """
+                UPDATE jobs SET
+                    status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                    error = ?, updated_at = ?, leased_until = NULL
+                WHERE id = ?
+                """,
+                (MAX_ATTEMPTS, str(error), time.time(), job_id),
+            )
+
+    def payload_age(self, fetcher, *args, **kwargs):
+        """Returns the age in seconds of the job's result if a worker had to fall back to a stale payload, else None."""
+        job = self.status(self.job_id(fetcher, args, kwargs))
+        if job is None or job["status"] != "done" or job["fetched_at"] is None:
+            return None
+        if job["updated_at"] - job["fetched_at"] < 1:
+            return None
+        return time.time() - job["fetched_at"]
+
+    def purge(self, older_than=3600):
+        """Deletes finished and failed jobs last updated more than older_than seconds ago."""
+        with self._connect() as conn:
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                (time.time() - older_than,),
+            )
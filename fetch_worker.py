@@ -0,0 +1,102 @@
+import argparse
+import multiprocessing
+import os
+import time
+
+import moralis_api
+from fetch_queue import JobQueue, QUEUE_PATH
+from key_pool import load_key_pool
+from resilience import payload_age
+
+PURGE_INTERVAL = 600  # seconds between sweeps of old finished jobs
+
+# Fetchers a job may name; each is called as fetcher(address, chain, api_key, *args, **kwargs)
+FETCHERS = {
+    fetcher.__name__: fetcher for fetcher in (
+        moralis_api.get_native_balance,
+        moralis_api.get_token_balances,
+        moralis_api.get_wallet_transactions,
+        moralis_api.get_nft_transfers,
+        moralis_api.get_nfts,
+        moralis_api.get_erc20_token_transfers,
+        moralis_api.get_token_price,
+        moralis_api.get_token_prices,
+        moralis_api.get_block_at_date,
+        moralis_api.get_wallet_net_worth,
+        moralis_api.get_wallet_pnl,
+        moralis_api.get_wallet_pnl_breakdown,
+    )
+}
+
+
+def run_job(job, api_key):
+    """Runs one claimed job and returns (result, fetched_at)."""
+    fetcher = FETCHERS[job["fetcher"]]
+    address, chain, *args = job["args"]
+    result = fetcher(address, chain, api_key, *args, **job["kwargs"])
+    age = payload_age(fetcher, address, chain, api_key, *args, **job["kwargs"])
+    return result, time.time() - (age or 0)
+
+def work(queue_path=QUEUE_PATH, poll_interval=0.5, workers=1):
+    """Claims and runs jobs from the queue until interrupted.
+
+    Every worker process has its own key pool, so each takes 1/workers of
+    every key's rate limit and daily budget.
+    """
+    queue = JobQueue(queue_path)
+    api_key = load_key_pool(moralis_api.load_config(), share=workers)
+    if not api_key:
+        print("Error: API key not found in config.ini")
+        return
+
+    print(f"Fetch worker {os.getpid()} started")
+    purged_at = 0.0
+    while True:
+        if time.monotonic() - purged_at > PURGE_INTERVAL:
+            queue.purge()
+            purged_at = time.monotonic()
+
+        job = queue.claim()
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+
+        if job["fetcher"] not in FETCHERS:
+            queue.fail(job["id"], f"Unknown fetcher {job['fetcher']}")
+            continue
+
+        try:
+            result, fetched_at = run_job(job, api_key)
+        except Exception as e:
+            print(f"Error running fetch job {job['id']}: {e}")
+            queue.fail(job["id"], e)
+            continue
+
+        if result is None:
+            queue.fail(job["id"], f"{job['fetcher']} returned no data")
+        else:
+            queue.complete(job["id"], result, fetched_at)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run fetch workers that serve the app's Moralis job queue.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--queue", default=QUEUE_PATH, help="path of the SQLite job queue")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="seconds to wait when the queue is empty")
+    args = parser.parse_args()
+
+    # Create the queue file before the workers start, rather than racing to do it
+    JobQueue(args.queue)
+    processes = [
+        multiprocessing.Process(target=work, args=(args.queue, args.poll_interval, args.workers), daemon=True)
+        for _ in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        print("Stopping fetch workers")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+import threading
+from array import array
+from collections import deque
+
+
+def _locked(method):
+    def call(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    call.__name__ = method.__name__
+    call.__doc__ = method.__doc__
+    return call
+
+
+# Token key of native coin transfers, which have no token contract
+NATIVE = "native"
+
+
+class FlowGraph:
+    """Directed graph of value flowing between wallets, built from transfer rows.
+
+    Addresses are interned to integer ids and each edge's aggregates live in
+    parallel arrays, so the graph stays compact with millions of edges. Token
+    amounts are kept per edge and token, since amounts of different tokens do
+    not add up; USD is the only total across tokens. A graph
+    holds one chain's transfers; updates and queries are locked, so app sessions
+    can share it.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._ids = {}          # address -> node id
+        self._addresses = []    # node id -> address
+        self._out = []          # node id -> {dst id: edge id}
+        self._in = []           # node id -> {src id: edge id}
+        self._token_ids = {}    # token address -> token id, NATIVE for the chain's own coin
+        self._token_addresses = []
+        self._usd = array('d')
+        self._tokens = []       # edge id -> {token id: amount}
+        self._counts = array('L')
+        # (node id, kind) -> time spans of that wallet's ingested pages, with the row
+        # hashes at their ends; keeps updates idempotent without a hash per transfer
+        self._coverage = {}
+
+    def __len__(self):
+        return len(self._addresses)
+
+    @property
+    def edge_count(self):
+        return len(self._counts)
+
+    def _token(self, token_address):
+        token_address = (token_address or NATIVE).lower()
+        token = self._token_ids.get(token_address)
+        if token is None:
+            token = len(self._token_addresses)
+            self._token_ids[token_address] = token
+            self._token_addresses.append(token_address)
+        return token
+
+    def _node(self, address):
+        address = address.lower()
+        node = self._ids.get(address)
+        if node is None:
+            node = len(self._addresses)
+            self._ids[address] = node
+            self._addresses.append(address)
+            self._out.append({})
+            self._in.append({})
+        return node
+
+    @_locked
+    def add_transfer(self, from_address, to_address, tokens=0.0, usd=0.0, token_address=None):
+        """Adds one transfer of tokens of token_address (None for native) to the edge from_address -> to_address."""
+        src = self._node(from_address)
+        dst = self._node(to_address)
+        token = self._token(token_address)
+        edge = self._out[src].get(dst)
+        if edge is None:
+            edge = len(self._counts)
+            self._out[src][dst] = edge
+            self._in[dst][src] = edge
+            self._usd.append(usd)
+            self._tokens.append({token: tokens})
+            self._counts.append(1)
+        else:
+            self._usd[edge] += usd
+            amounts = self._tokens[edge]
+            amounts[token] = amounts.get(token, 0.0) + tokens
+            self._counts[edge] += 1
+
+    @_locked
+    def add_transfers(self, wallet, transfers, price_lookup=None):
+        """Ingests one page of wallet's rows from get_erc20_token_transfers or get_wallet_transactions.
+
+        Rows already ingested, from an earlier page of wallet or from a page of
+        the counterparty, are skipped, so overlapping pages can be fed in as they
+        arrive. price_lookup(token_address, block_timestamp) may return a USD
+        price used when a row has no usd_value of its own; rows with no price add
+        nothing to the USD totals. Rows without a block_timestamp are skipped.
+        Returns the number of new transfers added.
+        """
+        wallet = self._node(wallet)
+        fed = {}  # kind -> [(block_timestamp, key)] of every row on the page
+        added = 0
+        for transfer in transfers or []:
+            from_address = transfer.get("from_address")
+            to_address = transfer.get("to_address")
+            timestamp = transfer.get("block_timestamp")
+            if not from_address or not to_address or not timestamp:
+                continue
+
+            tokens = transfer.get("value_with_decimals")
+            if tokens is None:
+                tokens = transfer.get("value", 0)
+            try:
+                tokens = float(tokens)
+            except (ValueError, TypeError):
+                tokens = 0.0
+
+            token_address = transfer.get("address")
+            kind = "token" if token_address else NATIVE
+            key = hash((
+                transfer.get("transaction_hash") or transfer.get("hash"),
+                from_address.lower(),
+                to_address.lower(),
+                token_address,
+                transfer.get("log_index"),
+                tokens,
+            ))
+            fed.setdefault(kind, []).append((timestamp, key))
+            if any(self._covered(self._ids.get(address.lower()), kind, timestamp, key)
+                   for address in (from_address, to_address)):
+                continue
+
+            usd = transfer.get("usd_value")
+            if usd is None and price_lookup is not None:
+                price = price_lookup(token_address, timestamp)
+                usd = tokens * price if price else 0.0
+            try:
+                usd = float(usd or 0.0)
+            except (ValueError, TypeError):
+                usd = 0.0
+
+            self.add_transfer(from_address, to_address, tokens, usd, token_address)
+            added += 1
+
+        for kind, rows in fed.items():
+            self._cover(wallet, kind, rows)
+        return added
+
+    def _covered(self, node, kind, timestamp, key):
+        # Inside an ingested page's time span every row was ingested; at its ends
+        # the page may have been cut mid-block, so the rows there are checked by key
+        for oldest, newest, oldest_keys, newest_keys in self._coverage.get((node, kind), ()):
+            if oldest < timestamp < newest:
+                return True
+            if (timestamp == oldest and key in oldest_keys) or (timestamp == newest and key in newest_keys):
+                return True
+        return False
+
+    def _cover(self, node, kind, rows):
+        oldest = min(timestamp for timestamp, _ in rows)
+        newest = max(timestamp for timestamp, _ in rows)
+        span = (oldest, newest,
+                {key for timestamp, key in rows if timestamp == oldest},
+                {key for timestamp, key in rows if timestamp == newest})
+        spans = []
+        for other in self._coverage.get((node, kind), ()):
+            if other[1] < span[0] or other[0] > span[1]:
+                spans.append(other)
+                continue
+            oldest, newest = min(span[0], other[0]), max(span[1], other[1])
+            span = (oldest, newest,
+                    (span[2] if span[0] == oldest else set()) | (other[2] if other[0] == oldest else set()),
+                    (span[3] if span[1] == newest else set()) | (other[3] if other[1] == newest else set()))
+        spans.append(span)
+        self._coverage[(node, kind)] = spans
+
+    @_locked
+    def edge(self, from_address, to_address):
+        """Returns the aggregated flow from_address -> to_address, or None."""
+        src = self._ids.get(from_address.lower())
+        dst = self._ids.get(to_address.lower())
+        if src is None or dst is None:
+            return None
+        edge = self._out[src].get(dst)
+        if edge is None:
+            return None
+        return self._edge_row(src, dst, edge)
+
+    def _edge_row(self, src, dst, edge):
+        return {
+            "from_address": self._addresses[src],
+            "to_address": self._addresses[dst],
+            "usd": self._usd[edge],
+            "tokens": {self._token_addresses[token]: amount for token, amount in self._tokens[edge].items()},
+            "count": self._counts[edge],
+        }
+
+    def _neighbours(self, node, direction):
+        if direction == "out":
+            return self._out[node].items()
+        if direction == "in":
+            return self._in[node].items()
+        return list(self._out[node].items()) + list(self._in[node].items())
+
+    @_locked
+    def counterparties(self, address, direction="both"):
+        """Returns one row per counterparty of address with the flow totals in each direction."""
+        node = self._ids.get(address.lower())
+        if node is None:
+            return []
+        rows = {}
+        if direction in ("out", "both"):
+            for dst, edge in self._out[node].items():
+                row = rows.setdefault(dst, {"address": self._addresses[dst], "usd_in": 0.0, "usd_out": 0.0, "count": 0})
+                row["usd_out"] += self._usd[edge]
+                row["count"] += self._counts[edge]
+        if direction in ("in", "both"):
+            for src, edge in self._in[node].items():
+                row = rows.setdefault(src, {"address": self._addresses[src], "usd_in": 0.0, "usd_out": 0.0, "count": 0})
+                row["usd_in"] += self._usd[edge]
+                row["count"] += self._counts[edge]
+        return sorted(rows.values(), key=lambda r: r["usd_in"] + r["usd_out"], reverse=True)
+
+    @_locked
+    def k_hop(self, address, k=1, direction="both", min_usd=0.0, limit=None):
+        """Breadth-first expansion from address, returning {address: hops} up to k hops away.
+
+        Edges carrying less than min_usd are not followed. limit caps the number
+        of addresses returned, which keeps queries around exchange hot wallets bounded.
+        """
+        start = self._ids.get(address.lower())
+        if start is None:
+            return {}
+        hops = {start: 0}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            depth = hops[node]
+            if depth >= k:
+                continue
+            for other, edge in self._neighbours(node, direction):
+                if other in hops or self._usd[edge] < min_usd:
+                    continue
+                hops[other] = depth + 1
+                if limit is not None and len(hops) > limit:
+                    return {self._addresses[n]: h for n, h in hops.items()}
+                queue.append(other)
+        return {self._addresses[n]: h for n, h in hops.items()}
+
+    @_locked
+    def subgraph_edges(self, addresses):
+        """Returns the edges running between the given addresses."""
+        nodes = {self._ids[a.lower()] for a in addresses if a.lower() in self._ids}
+        edges = []
+        for src in nodes:
+            for dst, edge in self._out[src].items():
+                if dst in nodes:
+                    edges.append(self._edge_row(src, dst, edge))
+        return edges
+
+    @_locked
+    def shared_counterparties(self, addresses, min_wallets=2):
+        """Returns counterparties that transacted with at least min_wallets of the given addresses."""
+        watched = {self._ids[a.lower()] for a in addresses if a.lower() in self._ids}
+        shared = {}
+        for node in watched:
+            for other, edge in self._neighbours(node, "both"):
+                if other in watched:
+                    continue
+                wallets, usd = shared.get(other, (set(), 0.0))
+                wallets.add(node)
+                shared[other] = (wallets, usd + self._usd[edge])
+
+        rows = []
+        for other, (wallets, usd) in shared.items():
+            if len(wallets) >= min_wallets:
+                rows.append({
+                    "counterparty": self._addresses[other],
+                    "wallets": sorted(self._addresses[w] for w in wallets),
+                    "wallet_count": len(wallets),
+                    "usd": usd,
+                })
+        rows.sort(key=lambda r: (r["wallet_count"], r["usd"]), reverse=True)
+        return rows
+
+    @_locked
+    def clusters(self, addresses, via_shared=True, max_counterparty_degree=50):
+        """Groups watched addresses that transfer to each other or share a counterparty.
+
+        Counterparties with more than max_counterparty_degree neighbours (routers,
+        exchange hot wallets) are ignored when linking through shared counterparties,
+        otherwise they would merge every wallet into one cluster.
+        Returns a list of clusters, largest first.
+        """
+        watched = [self._ids[a.lower()] for a in addresses if a.lower() in self._ids]
+        parent = {node: node for node in watched}
+
+        def find(node):
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        def union(a, b):
+            root_a, root_b = find(a), find(b)
+            if root_a != root_b:
+                parent[root_b] = root_a
+
+        hubs = {}
+        for node in watched:
+            for other, _ in self._neighbours(node, "both"):
+                if other in parent:
+                    union(node, other)
+                elif via_shared:
+                    degree = len(self._out[other]) + len(self._in[other])
+                    if degree <= max_counterparty_degree:
+                        if other in hubs:
+                            union(hubs[other], node)
+                        else:
+                            hubs[other] = node
+
+        groups = {}
+        for node in watched:
+            groups.setdefault(find(node), []).append(self._addresses[node])
+        return sorted((sorted(group) for group in groups.values()), key=len, reverse=True)
+
+    @_locked
+    def clear(self):
+        self._reset()
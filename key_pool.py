@@ -0,0 +1,176 @@
+import threading
+import time
+
+# Approximate compute units Moralis charges per call, by SDK endpoint name
+COMPUTE_UNITS = {
+    "get_native_balance": 10,
+    "get_spl": 10,
+    "get_wallet_token_balances": 100,
+    "get_wallet_token_balances_price": 100,
+    "get_wallet_transactions": 30,
+    "get_wallet_nft_transfers": 50,
+    "get_wallet_nfts": 50,
+    "get_wallet_token_transfers": 50,
+    "get_token_price": 50,
+    "get_multiple_token_prices": 100,  # per request of up to 25 tokens
+    "get_wallet_net_worth": 500,
+    "get_wallet_profitability_summary": 50,
+    "get_wallet_profitability": 50,
+}
+DEFAULT_COMPUTE_UNITS = 50
+
+DEFAULT_RATE_LIMIT = 25             # requests per second per key
+DEFAULT_COMPUTE_UNIT_BUDGET = 40000  # compute units per key per UTC day
+RATE_LIMIT_PARK_SECONDS = 10
+ACQUIRE_TIMEOUT = 10
+
+
+class NoKeyAvailableError(Exception):
+    pass
+
+
+class ApiKey:
+    """One Moralis API key with its own request rate and daily compute-unit budget."""
+
+    def __init__(self, key, weight=1, rate_limit=DEFAULT_RATE_LIMIT, compute_unit_budget=DEFAULT_COMPUTE_UNIT_BUDGET):
+        self.key = key
+        self.weight = weight
+        self.rate_limit = rate_limit
+        self.compute_unit_budget = compute_unit_budget
+        self.tokens = max(float(rate_limit), 1.0)
+        self.refilled_at = time.monotonic()
+        self.compute_units_used = 0
+        self.budget_day = time.gmtime().tm_yday
+        self.parked_until = 0.0
+        self.in_flight = 0
+        self.current_weight = 0
+
+    def __repr__(self):
+        # Never print the key itself
+        return f"ApiKey(...{self.key[-4:]}, weight={self.weight})"
+
+    def _refill(self, now):
+        # Hold at least one token, so a rate limit below 1/s still lets a call through now and then
+        self.tokens = min(max(float(self.rate_limit), 1.0), self.tokens + (now - self.refilled_at) * self.rate_limit)
+        self.refilled_at = now
+        today = time.gmtime().tm_yday
+        if today != self.budget_day:
+            self.budget_day = today
+            self.compute_units_used = 0
+            self.parked_until = 0.0
+
+    def available(self, now, compute_units):
+        self._refill(now)
+        return (now >= self.parked_until
+                and self.tokens >= 1
+                and self.compute_units_used + compute_units <= self.compute_unit_budget)
+
+
+class KeyPool:
+    """Spreads Moralis calls over several API keys.
+
+    Keys are chosen by smooth weighted round-robin, or by fewest in-flight calls
+    per unit of weight with selection="least_loaded". A key that is rate limited
+    is parked for a few seconds; a key that is out of quota or rejected is parked
+    until its budget resets.
+    """
+
+    def __init__(self, keys, selection="weighted"):
+        self.keys = list(keys)
+        self.selection = selection
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.keys)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __repr__(self):
+        return f"KeyPool({len(self.keys)} keys, {self.selection})"
+
+    def _pick(self, candidates):
+        if self.selection == "least_loaded":
+            return min(candidates, key=lambda k: (k.in_flight / k.weight, k.compute_units_used / k.compute_unit_budget))
+        total = sum(k.weight for k in candidates)
+        for k in candidates:
+            k.current_weight += k.weight
+        chosen = max(candidates, key=lambda k: k.current_weight)
+        chosen.current_weight -= total
+        return chosen
+
+    def acquire(self, compute_units=DEFAULT_COMPUTE_UNITS, timeout=ACQUIRE_TIMEOUT):
+        """Reserves a request and compute units on the best available key, waiting out rate limits."""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                candidates = [k for k in self.keys if k.available(now, compute_units)]
+                if candidates:
+                    chosen = self._pick(candidates)
+                    chosen.tokens -= 1
+                    chosen.compute_units_used += compute_units
+                    chosen.in_flight += 1
+                    return chosen
+                # Only keys that will become usable again before the deadline are worth waiting for
+                waits = [max(k.parked_until - now, (1 - k.tokens) / k.rate_limit) for k in self.keys
+                         if k.compute_units_used + compute_units <= k.compute_unit_budget]
+            if not waits or now + min(waits) > deadline:
+                raise NoKeyAvailableError("All Moralis API keys are rate limited or out of compute units")
+            time.sleep(min(waits))
+
+    def release(self, api_key, error=None):
+        with self._lock:
+            api_key.in_flight -= 1
+            status = getattr(error, "status", None)
+            if status == 429:
+                print(f"Parking {api_key!r}: rate limited")
+                api_key.parked_until = time.monotonic() + RATE_LIMIT_PARK_SECONDS
+            elif status in (401, 402, 403):
+                print(f"Parking {api_key!r} until its budget resets: rejected with status {status}")
+                api_key.compute_units_used = api_key.compute_unit_budget
+
+    def call(self, endpoint, func, **kwargs):
+        """Calls func with a key from the pool, moving on to another key if this one is parked."""
+        compute_units = COMPUTE_UNITS.get(endpoint, DEFAULT_COMPUTE_UNITS)
+        for attempt in range(len(self.keys)):
+            api_key = self.acquire(compute_units)
+            try:
+                result = func(**{**kwargs, "api_key": api_key.key})
+            except Exception as e:
+                self.release(api_key, e)
+                if getattr(e, "status", None) in (401, 402, 403, 429) and attempt < len(self.keys) - 1:
+                    continue
+                raise
+            self.release(api_key)
+            return result
+
+
+def load_key_pool(config, share=1):
+    """Builds a KeyPool from config.ini.
+
+    Each [moralis.<name>] section holds one key with optional weight, rate_limit
+    and compute_unit_budget; defaults for those come from [moralis]. A lone
+    [moralis] api_key still works as a pool of one.
+
+    share is the number of processes that build a pool from the same keys; each
+    of them gets 1/share of every key's rate limit and daily budget.
+    """
+    defaults = config["moralis"] if config.has_section("moralis") else {}
+    rate_limit = float(defaults.get("rate_limit", DEFAULT_RATE_LIMIT))
+    budget = int(defaults.get("compute_unit_budget", DEFAULT_COMPUTE_UNIT_BUDGET))
+
+    keys = []
+    for section in config.sections():
+        if section.startswith("moralis.") and config[section].get("api_key"):
+            entry = config[section]
+            keys.append(ApiKey(
+                entry["api_key"],
+                weight=float(entry.get("weight", 1)),
+                rate_limit=float(entry.get("rate_limit", rate_limit)) / share,
+                compute_unit_budget=int(entry.get("compute_unit_budget", budget)) // share,
+            ))
+    if not keys and defaults.get("api_key"):
+        keys.append(ApiKey(defaults["api_key"], rate_limit=rate_limit / share, compute_unit_budget=budget // share))
+
+    return KeyPool(keys, selection=defaults.get("key_selection", "weighted"))
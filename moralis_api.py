@@ -1,25 +1,66 @@
-from moralis import evm_api, sol_api
 import configparser
+import os
+import threading
 import time
 from cachetools import TTLCache, cached
+from cachetools.keys import hashkey
+from utils import format_pnl_summary, format_pnl_breakdown
+from resilience import call_endpoint, last_known_good
+from key_pool import load_key_pool
+from spam_index import get_spam_index
+from response_decoding import projected
+from sdk_clients import evm_api, sol_api, shared_client
 
 # Cache for Moralis API responses with a TTL of 1 minute (60 seconds)
 moralis_cache = TTLCache(maxsize=100, ttl=60)
+# Every app session shares the cache from its own thread
+moralis_cache_lock = threading.RLock()
+
+_config = None
+_config_mtime = None
 
 def load_config():
-    config = configparser.ConfigParser()
-    config.read('config.ini')
-    return config
+    """Parses config.ini once per process, and again only when the file changes."""
+    global _config, _config_mtime
+    try:
+        mtime = os.path.getmtime('config.ini')
+    except OSError:
+        mtime = None
+    if _config is None or mtime != _config_mtime:
+        config = configparser.ConfigParser()
+        config.read('config.ini')
+        _config, _config_mtime = config, mtime
+    return _config
+
+# Built once per process so key budgets and parking are shared by every caller
+_key_pool = None
 
 def get_api_key():
-    config = load_config()
-    try:
-        api_key = config['moralis']['api_key']
-    except KeyError:
-        print("Error: API key not found in config.ini")
-        api_key = None
-    return api_key
+    """Returns the pool of Moralis API keys configured in config.ini, or None if there are none."""
+    global _key_pool
+    if _key_pool is None:
+        key_pool = load_key_pool(load_config())
+        if not key_pool:
+            print("Error: API key not found in config.ini")
+            return None
+        _key_pool = key_pool
+    return _key_pool
 
+def fetch_key(fetcher):
+    """Returns the cache key function for a fetcher sharing moralis_cache.
+
+    Keys start with the fetcher's name, so fetchers called with the same arguments
+    never read each other's results, and leave out the api_key argument, so
+    results are shared across the key pool.
+    """
+    def key(*args, api_key=None, **kwargs):
+        if api_key is None and len(args) >= 3:
+            args = args[:2] + args[3:]
+        return hashkey(fetcher, *args, **kwargs)
+
+    return key
+
+@last_known_good
 def get_native_balance(address, chain, api_key):
     if not api_key:
         print("Error: API key not loaded from config.ini.")
@@ -28,7 +69,7 @@ def get_native_balance(address, chain, api_key):
     try:
         if chain == "solana":
             # Solana: Use the get_native_balance from sol_api
-            result = sol_api.account.get_native_balance(
+            result = call_endpoint("get_native_balance", chain, shared_client(sol_api.account.get_native_balance),
                 api_key=api_key,
                 params={
                     "network": "mainnet",
@@ -40,7 +81,7 @@ def get_native_balance(address, chain, api_key):
             return balance_sol
         else:
             # EVM: Use the get_native_balance from evm_api
-            result = evm_api.balance.get_native_balance(
+            result = call_endpoint("get_native_balance", chain, shared_client(evm_api.balance.get_native_balance),
                 api_key=api_key,
                 params={
                     "address": address,
@@ -55,8 +96,43 @@ def get_native_balance(address, chain, api_key):
         print(f"Error getting native balance: {e}")
         return None
 
-@cached(moralis_cache)
-def get_token_balances(address, chain, api_key):
+def is_unwanted_contract(contract_address, possible_spam, verified, exclude_spam, exclude_unverified_contracts):
+    """Decides from a raw row's flags whether to drop it before it is converted or cached.
+
+    Contracts Moralis flags as spam are remembered in the spam index, so they are
+    also dropped from endpoints that do not report the flag or cannot exclude spam.
+    A row that reports the flag as false takes the contract out of the index again.
+    """
+    spam_index = get_spam_index()
+    if possible_spam:
+        spam_index.add(contract_address)
+    elif possible_spam is False:
+        spam_index.remove(contract_address)
+    if exclude_spam and (possible_spam or contract_address in spam_index):
+        return True
+    # Only drop contracts Moralis reports as unverified, not ones it says nothing about
+    return exclude_unverified_contracts and verified is False
+
+def token_amount(value, value_decimal=None, decimals=None):
+    """Returns a raw token amount in whole tokens, using the token's own decimals (18 if unknown)."""
+    if value_decimal is not None:
+        try:
+            return float(value_decimal)
+        except (ValueError, TypeError):
+            pass
+    try:
+        decimals = int(decimals)
+    except (ValueError, TypeError):
+        decimals = 18
+    return int(value or 0) / 10 ** decimals
+
+@cached(moralis_cache, key=fetch_key("get_token_balances"), lock=moralis_cache_lock)
+@last_known_good
+def get_token_balances(address, chain, api_key, exclude_spam=True, exclude_unverified_contracts=False, min_usd_value=0):
+    """Returns the wallet's token balances, leaving out EVM balances worth less than min_usd_value.
+
+    Balances Moralis cannot price, and Solana balances, which come without prices, are kept.
+    """
     print("Fetching token balances from API (not cached)")
     if not api_key:
         print("Error: API key not loaded from config.ini.")
@@ -64,7 +140,7 @@ def get_token_balances(address, chain, api_key):
     
     try:
         if chain == "solana":
-            result = sol_api.account.get_spl(
+            result = call_endpoint("get_spl", chain, shared_client(sol_api.account.get_spl),
                 api_key=api_key,
                 params={
                     "network": "mainnet",
@@ -74,9 +150,13 @@ def get_token_balances(address, chain, api_key):
 
             token_balances = []
             for token in result:
+                token_address = token["mint"]
+                if is_unwanted_contract(token_address, token.get("possible_spam"), None,
+                                        exclude_spam, exclude_unverified_contracts):
+                    continue
+
                 token_name = token.get("name", "N/A")
                 token_symbol = token.get("symbol", "N/A")
-                token_address = token["mint"]
                 
                 # Handle the amount as a float
                 try:
@@ -99,22 +179,31 @@ def get_token_balances(address, chain, api_key):
                         "logo": token.get("thumbnail"),
                         "total_supply_formatted": token.get("total_supply"),  # Not available in SPL response
                     })
+            get_spam_index().save()
             return token_balances
         else:
-            # EVM: Use the get_wallet_token_balances from evm_api
-            result = evm_api.token.get_wallet_token_balances(
+            # EVM: balances with USD prices, so dust is judged by value; Moralis drops spam and unverified contracts itself
+            result = call_endpoint("get_wallet_token_balances_price", chain,
+                shared_client(evm_api.wallets.get_wallet_token_balances_price),
                 api_key=api_key,
                 params={
                     "address": address,
                     "chain": chain,
+                    "exclude_spam": exclude_spam,
+                    "exclude_unverified_contracts": exclude_unverified_contracts,
+                    "exclude_native": True,
                 },
             )
 
             token_balances = []
-            for token in result:
+            for token in result.get("result") or []:
+                token_address = token["token_address"]
+                if is_unwanted_contract(token_address, token.get("possible_spam"), token.get("verified_contract"),
+                                        exclude_spam, exclude_unverified_contracts):
+                    continue
+
                 token_name = token.get("name", "N/A")
                 token_symbol = token.get("symbol", "N/A")
-                token_address = token["token_address"]
                 balance_wei = int(token["balance"])
                 
                 # Handle missing or None decimals
@@ -125,12 +214,14 @@ def get_token_balances(address, chain, api_key):
                     print(f"Warning: Invalid decimals value for {token_symbol} ({token_address}). Skipping balance formatting.")
                     balance = balance_wei
 
-                if balance > 0:
+                usd_value = token.get("usd_value")
+                if balance > 0 and (usd_value is None or usd_value >= min_usd_value):
                     token_balances.append({
                         "name": token_name,
                         "symbol": token_symbol,
                         "address": token_address,
                         "balance": balance,
+                        "usd_value": usd_value,
                         "logo": token.get("thumbnail", None),
                         "decimals": token.get("decimals"),
                         "total_supply_formatted": token.get("total_supply_formatted"),
@@ -140,13 +231,15 @@ def get_token_balances(address, chain, api_key):
                         "security_score": token.get("security_score")
                     })
 
+            get_spam_index().save()
             return token_balances
 
     except Exception as e:
         print(f"Error getting token balances: {e}")
         return None
 
-@cached(moralis_cache)
+@cached(moralis_cache, key=fetch_key("get_wallet_transactions"), lock=moralis_cache_lock)
+@last_known_good
 def get_wallet_transactions(address, chain, api_key, from_block=None, to_block=None, from_date=None, to_date=None):
     print("Fetching wallet transactions from API (not cached)")
     if not api_key:
@@ -167,21 +260,21 @@ def get_wallet_transactions(address, chain, api_key, from_block=None, to_block=N
         if to_date:
             params["to_date"] = to_date
         
-        result = evm_api.transaction.get_wallet_transactions(
+        result = call_endpoint("get_wallet_transactions", chain, projected(evm_api.transaction.get_wallet_transactions),
             api_key=api_key,
             params=params,
         )
         
         transactions = []
-        for tx in result.get('result', []):
+        for tx_hash, from_address, to_address, value, gas, gas_price, block_timestamp in result['result']:
             transactions.append({
-                "hash": tx.get("hash"),
-                "from_address": tx.get("from_address"),
-                "to_address": tx.get("to_address"),
-                "value": int(tx.get("value", 0)) / 1e18,
-                "gas": tx.get("gas"),
-                "gas_price": int(tx.get("gas_price", 0)) / 1e9,
-                "block_timestamp": tx.get("block_timestamp")
+                "hash": tx_hash,
+                "from_address": from_address,
+                "to_address": to_address,
+                "value": int(value or 0) / 1e18,
+                "gas": gas,
+                "gas_price": int(gas_price or 0) / 1e9,
+                "block_timestamp": block_timestamp
             })
 
         return transactions
@@ -189,15 +282,16 @@ def get_wallet_transactions(address, chain, api_key, from_block=None, to_block=N
         print(f"Error getting wallet transactions: {e}")
         return None
 
-@cached(moralis_cache)
-def get_nft_transfers(address, chain, api_key):
+@cached(moralis_cache, key=fetch_key("get_nft_transfers"), lock=moralis_cache_lock)
+@last_known_good
+def get_nft_transfers(address, chain, api_key, exclude_spam=True, exclude_unverified_contracts=False):
     print("Fetching NFT transfers from API (not cached)")
     if not api_key:
         print("Error: API key not loaded from config.ini.")
         return None
 
     try:
-        result = evm_api.nft.get_wallet_nft_transfers(
+        result = call_endpoint("get_wallet_nft_transfers", chain, projected(evm_api.nft.get_wallet_nft_transfers),
             api_key=api_key,
             params={
                 "address": address,
@@ -206,70 +300,84 @@ def get_nft_transfers(address, chain, api_key):
         )
 
         transfers = []
-        for transfer in result.get('result', []):
+        for (block_number, transaction_hash, from_address, to_address, token_address,
+             token_id, amount, possible_spam, verified_contract, block_timestamp) in result['result']:
+            # This endpoint has no exclude_spam option, so spam is dropped here
+            if is_unwanted_contract(token_address, possible_spam, verified_contract,
+                                    exclude_spam, exclude_unverified_contracts):
+                continue
             transfers.append({
-                "block_number": transfer.get("block_number"),
-                "transaction_hash": transfer.get("transaction_hash"),
-                "from_address": transfer.get("from_address"),
-                "to_address": transfer.get("to_address"),
-                "token_address": transfer.get("token_address"),
-                "token_id": transfer.get("token_id"),
-                "amount": transfer.get("amount"),
-                "possible_spam": transfer.get("possible_spam"),
-                "verified_contract": transfer.get("verified_contract"),
-                "block_timestamp": transfer.get("block_timestamp")
+                "block_number": block_number,
+                "transaction_hash": transaction_hash,
+                "from_address": from_address,
+                "to_address": to_address,
+                "token_address": token_address,
+                "token_id": token_id,
+                "amount": amount,
+                "possible_spam": possible_spam,
+                "verified_contract": verified_contract,
+                "block_timestamp": block_timestamp
             })
 
+        get_spam_index().save()
         return transfers
     except Exception as e:
         print(f"Error getting NFT transfers: {e}")
         return None
 
-@cached(moralis_cache)
-def get_nfts(address, chain, api_key):
+@cached(moralis_cache, key=fetch_key("get_nfts"), lock=moralis_cache_lock)
+@last_known_good
+def get_nfts(address, chain, api_key, exclude_spam=True, exclude_unverified_contracts=False):
     print("Fetching NFTs from API (not cached)")
     if not api_key:
         print("Error: API key not loaded from config.ini.")
         return None
 
     try:
-        result = evm_api.nft.get_wallet_nfts(
+        result = call_endpoint("get_wallet_nfts", chain, projected(evm_api.nft.get_wallet_nfts),
             api_key=api_key,
             params={
                 "address": address,
                 "chain": chain,
+                "exclude_spam": exclude_spam,
             },
         )
 
         nfts = []
-        for nft in result.get('result', []):
+        for (name, symbol, token_address, token_id, amount, contract_type,
+             token_uri, metadata, possible_spam, verified_collection) in result['result']:
+            if is_unwanted_contract(token_address, possible_spam, verified_collection,
+                                    exclude_spam, exclude_unverified_contracts):
+                continue
             nfts.append({
-                "name": nft.get("name"),
-                "symbol": nft.get("symbol"),
-                "token_address": nft.get("token_address"),
-                "token_id": nft.get("token_id"),
-                "amount": nft.get("amount"),
-                "contract_type": nft.get("contract_type"),
-                "token_uri": nft.get("token_uri"),
-                "metadata": format_nft_metadata(nft.get("metadata")),
-                "possible_spam": nft.get("possible_spam"),
-                "verified_collection": nft.get("verified_collection")
+                "name": name,
+                "symbol": symbol,
+                "token_address": token_address,
+                "token_id": token_id,
+                "amount": amount,
+                "contract_type": contract_type,
+                "token_uri": token_uri,
+                "metadata": format_nft_metadata(metadata),
+                "possible_spam": possible_spam,
+                "verified_collection": verified_collection
             })
 
+        get_spam_index().save()
         return nfts
     except Exception as e:
         print(f"Error getting NFTs: {e}")
         return None
 
-@cached(moralis_cache)
-def get_erc20_token_transfers(address, chain, api_key):
+@cached(moralis_cache, key=fetch_key("get_erc20_token_transfers"), lock=moralis_cache_lock)
+@last_known_good
+def get_erc20_token_transfers(address, chain, api_key, exclude_spam=True, exclude_unverified_contracts=False):
     print("Fetching ERC20 token transfers from API (not cached)")
     if not api_key:
         print("Error: API key not loaded from config.ini.")
         return None
 
     try:
-        result = evm_api.token.get_wallet_token_transfers(
+        result = call_endpoint("get_wallet_token_transfers", chain, projected(evm_api.token.get_wallet_token_transfers),
             api_key=api_key,
             params={
                 "address": address,
@@ -278,27 +386,126 @@ def get_erc20_token_transfers(address, chain, api_key):
         )
 
         erc20_transfers = []
-        for transfer in result.get('result', []):
+        for (transaction_hash, token_name, token_symbol, token_address, possible_spam, verified_contract,
+             to_address, from_address, value, value_decimal, token_decimals, block_number,
+             log_index, block_timestamp) in result['result']:
+            # This endpoint has no exclude_spam option, so spam is dropped here
+            if is_unwanted_contract(token_address, possible_spam, verified_contract,
+                                    exclude_spam, exclude_unverified_contracts):
+                continue
+            value = token_amount(value, value_decimal, token_decimals)
             erc20_transfers.append({
-                "transaction_hash": transfer.get("transaction_hash"),
-                "token_name":transfer.get("token_name"),
-                "token_symbol":transfer.get("token_symbol"),
-                "address": transfer.get("address"),
-                "possible_spam":"✅" if transfer.get("possible_spam") else "❌",
-                "to_address": transfer.get("to_address"),
-                "from_address": transfer.get("from_address"),
-                "value": int(transfer.get("value", 0)) / 1e18,
-                "value_with_decimals": transfer.get("value_with_decimals"),
-                "block_timestamp": transfer.get("block_timestamp")
+                "transaction_hash": transaction_hash,
+                "token_name": token_name,
+                "token_symbol": token_symbol,
+                "address": token_address,
+                "possible_spam": "✅" if possible_spam else "❌",
+                "to_address": to_address,
+                "from_address": from_address,
+                "value": value,
+                "value_with_decimals": value_decimal,
+                "block_number": block_number,
+                "log_index": log_index,
+                "block_timestamp": block_timestamp
             })
 
+        get_spam_index().save()
         return erc20_transfers
         
     except Exception as e:
         print(f"Error getting ERC20 token transfers: {e}")
         return None
 
-@cached(moralis_cache)
+@last_known_good
+def get_token_price(token_address, chain, api_key, to_block=None):
+    if not api_key:
+        print("Error: API key not loaded from config.ini.")
+        return None
+
+    try:
+        params = {
+            "address": token_address,
+            "chain": chain,
+        }
+        if to_block:
+            params["to_block"] = to_block
+
+        result = call_endpoint("get_token_price", chain, shared_client(evm_api.token.get_token_price),
+            api_key=api_key,
+            params=params,
+        )
+        return float(result.get("usdPrice", 0))
+    except Exception as e:
+        print(f"Error getting token price: {e}")
+        return None
+
+# Most tokens get_multiple_token_prices accepts in one request
+TOKEN_PRICE_BATCH_SIZE = 25
+
+def get_token_prices(tokens, chain, api_key):
+    """Fetches USD prices for many (token_address, to_block) pairs, TOKEN_PRICE_BATCH_SIZE per request.
+
+    A to_block of None asks for the latest price. Returns a list of prices in the
+    same order as tokens, with None where Moralis has no price or a request failed.
+    """
+    if not api_key:
+        print("Error: API key not loaded from config.ini.")
+        return None
+
+    prices = []
+    for start in range(0, len(tokens), TOKEN_PRICE_BATCH_SIZE):
+        batch = tokens[start:start + TOKEN_PRICE_BATCH_SIZE]
+        body = {"tokens": [
+            {"token_address": token_address, **({"to_block": str(to_block)} if to_block is not None else {})}
+            for token_address, to_block in batch
+        ]}
+        try:
+            result = call_endpoint("get_multiple_token_prices", chain, shared_client(evm_api.token.get_multiple_token_prices),
+                api_key=api_key,
+                params={"chain": chain},
+                body=body,
+            )
+        except Exception as e:
+            print(f"Error getting token prices: {e}")
+            prices.extend([None] * len(batch))
+            continue
+
+        # Tokens Moralis cannot price are left out of the response, so match on address and block
+        by_block = {}
+        latest = {}
+        for item in result or []:
+            token_address = (item.get("tokenAddress") or "").lower()
+            price = float(item["usdPrice"]) if item.get("usdPrice") is not None else None
+            by_block[(token_address, str(item.get("toBlock")))] = price
+            latest.setdefault(token_address, price)
+        for token_address, to_block in batch:
+            token_address = token_address.lower()
+            if to_block is None:
+                prices.append(latest.get(token_address))
+            else:
+                prices.append(by_block.get((token_address, str(to_block))))
+    return prices
+
+def get_block_at_date(date, chain, api_key):
+    """Returns the number of the last block mined at or before date, or None."""
+    if not api_key:
+        print("Error: API key not loaded from config.ini.")
+        return None
+
+    try:
+        result = call_endpoint("get_date_to_block", chain, shared_client(evm_api.block.get_date_to_block),
+            api_key=api_key,
+            params={
+                "date": date,
+                "chain": chain,
+            },
+        )
+        return int(result["block"])
+    except Exception as e:
+        print(f"Error getting block at date: {e}")
+        return None
+
+@cached(moralis_cache, lock=moralis_cache_lock)
 def format_nft_metadata(metadata):
     """Formats NFT metadata for display."""
     if metadata:
@@ -313,7 +520,8 @@ def format_nft_metadata(metadata):
             return metadata  # Return as is if not a valid JSON
     return "N/A"
 
-@cached(moralis_cache)
+@cached(moralis_cache, key=fetch_key("get_wallet_net_worth"), lock=moralis_cache_lock)
+@last_known_good
 def get_wallet_net_worth(address, chain, api_key, exclude_spam=True, exclude_unverified_contracts=True):
     if not api_key:
         print("Error: API key not loaded from config.ini.")
@@ -321,7 +529,7 @@ def get_wallet_net_worth(address, chain, api_key, exclude_spam=True, exclude_unv
 
     try:
         # EVM: Use the get_wallet_net_worth from evm_api
-        result = evm_api.wallets.get_wallet_net_worth(
+        result = call_endpoint("get_wallet_net_worth", chain, shared_client(evm_api.wallets.get_wallet_net_worth),
             api_key=api_key,
             params={
                 "address": address,
@@ -377,7 +585,8 @@ def get_wallet_net_worth(address, chain, api_key, exclude_spam=True, exclude_unv
         print(f"Error getting wallet net worth: {e}")
         return None
     
-@cached(moralis_cache)
+@cached(moralis_cache, key=fetch_key("get_wallet_pnl"), lock=moralis_cache_lock)
+@last_known_good
 def get_wallet_pnl(address, chain, api_key):
     print("Fetching wallet PnL from API (not cached)")
     if not api_key:
@@ -386,7 +595,7 @@ def get_wallet_pnl(address, chain, api_key):
 
     try:
         # EVM: Use the get_wallet_pnl from evm_api
-        result = evm_api.wallets.get_wallet_profitability_summary(
+        result = call_endpoint("get_wallet_profitability_summary", chain, shared_client(evm_api.wallets.get_wallet_profitability_summary),
             api_key=api_key,
             params={
                 "address": address,
@@ -394,32 +603,7 @@ def get_wallet_pnl(address, chain, api_key):
             },
         )
 
-        pnl_data = [
-                {
-                    "Metric": "total_count_of_trades",
-                    "Value": f"{float(result['total_count_of_trades']):,.2f}"
-                },
-                {
-                    "Metric": "total_trade_volume",
-                    "Value": f"{float(result.get('total_trade_volume', 0)):,.2f}"
-                },
-                {
-                    "Metric": "total_realized_profit_usd",
-                    "Value": f"{float(result.get('total_realized_profit_usd', 0)):,.2f}"
-                },
-                {
-                    "Metric": "Total Realized Profit (%)",
-                    "Value": f"{float(result.get('total_realized_profit_percentage', 0)):,.2f}%" if result.get('total_realized_profit_percentage') is not None else "N/A"
-                },
-                {
-                    "Metric": "total_sold_volume_usd",
-                    "Value": f"{float(result.get('total_sold_volume_usd', 0)):,.2f}"
-                },
-                                {
-                    "Metric": "total_bought_volume_usd",
-                    "Value": f"{float(result.get('total_bought_volume_usd', 0)):,.2f}"
-                }
-            ]
+        pnl_data = format_pnl_summary(result)
         
         return pnl_data
 
@@ -427,7 +611,8 @@ def get_wallet_pnl(address, chain, api_key):
         print(f"Error getting wallet PnL: {e}")
         return None
     
-@cached(moralis_cache)
+@cached(moralis_cache, key=fetch_key("get_wallet_pnl_breakdown"), lock=moralis_cache_lock)
+@last_known_good
 def get_wallet_pnl_breakdown(address, chain, api_key):
     print("Fetching wallet PnL breakdown from API (not cached)")
     if not api_key:
@@ -436,7 +621,7 @@ def get_wallet_pnl_breakdown(address, chain, api_key):
 
     try:
         # EVM: Use the get_wallet_pnl from evm_api
-        result = evm_api.wallets.get_wallet_profitability(
+        result = call_endpoint("get_wallet_profitability", chain, shared_client(evm_api.wallets.get_wallet_profitability),
             api_key=api_key,
             params={
                 "address": address,
@@ -448,84 +633,7 @@ def get_wallet_pnl_breakdown(address, chain, api_key):
         if isinstance(result, dict) and 'result' in result:
             pnl_data = []
             for pnl in result.get('result', []):
-                pnl_data_breakdown = [
-                    {
-                        "Metric": "token_address",
-                        "Value": pnl.get("token_address", "N/A")
-                    },
-                    {
-                        "Metric": "total_trade_volume",
-                        "Value": f"{float(pnl.get('total_trade_volume', 0)):,.2f}"
-                    },
-                    {
-                        "Metric": "total_realized_profit_usd",
-                        "Value": f"{float(pnl.get('total_realized_profit_usd', 0)):,.2f}"
-                    },
-                    {
-                        "Metric": "Total Realized Profit (%)",
-                        "Value": f"{float(pnl.get('total_realized_profit_percentage', 0)):,.2f}%" if pnl.get('total_realized_profit_percentage') is not None else "N/A"
-                    },
-                    {
-                        "Metric": "total_sold_volume_usd",
-                        "Value": f"{float(pnl.get('total_sold_volume_usd', 0)):,.2f}"
-                    },
-                    {
-                        "Metric": "total_bought_volume_usd",
-                        "Value": f"{float(pnl.get('total_bought_volume_usd', 0)):,.2f}"
-                    },
-                    {
-                        "Metric": "avg_buy_price_usd",
-                        "Value": f"{float(pnl.get('avg_buy_price_usd', 0)):,.2f}"
-                    },
-                    {
-                        "Metric": "avg_sell_price_usd",
-                        "Value": f"{float(pnl.get('avg_sell_price_usd', 0)):,.2f}"
-                    },
-                    {
-                        "Metric": "total_tokens_bought",
-                        "Value": f"{float(pnl.get('total_tokens_bought', 0)):,.2f}"
-                    },
-                    {
-                        "Metric": "total_tokens_sold",
-                        "Value": f"{float(pnl.get('total_tokens_sold', 0)):,.2f}"
-                    },
-                    {
-                        "Metric": "avg_cost_of_quantity_sold",
-                        "Value": f"{float(pnl.get('avg_cost_of_quantity_sold', 0)):,.2f}"
-                    },
-                    {
-                        "Metric": "count_of_trades",
-                        "Value": pnl.get("count_of_trades", "N/A")
-                    },
-                    {
-                        "Metric": "total_buys",
-                        "Value": pnl.get("total_buys", "N/A")
-                    },
-                    {
-                        "Metric": "total_sells",
-                        "Value": pnl.get("total_sells", "N/A")
-                    },
-                    {
-                        "Metric": "name",
-                        "Value": pnl.get("name", "N/A")
-                    },
-                    {
-                        "Metric": "symbol",
-                        "Value": pnl.get("symbol", "N/A")
-                    },
-                    {
-                        "Metric": "possible_spam",
-                        "Value": pnl.get("possible_spam", "N/A")
-                    },
-                    {
-                        "Metric": "verified_contract",
-                        "Value": pnl.get("verified_contract", "N/A")
-                    },
-                    {
-                        "Metric": "security_score",
-                        "Value": pnl.get("security_score", "N/A")
-                    },
-                ]
+                pnl_data_breakdown = format_pnl_breakdown(pnl)
 
                 pnl_data.append(pnl_data_breakdown)
 
@@ -0,0 +1,440 @@
+import datetime
+import math
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from moralis_api import get_block_at_date, get_token_prices
+
+# Where historical prices are kept between runs, so recomputing PnL costs no API calls
+PRICE_HISTORY_PATH = "price_history.npz"
+# Held tokens are only valued with a price from at most this long before the valuation time
+VALUATION_MAX_AGE = 86400
+
+
+def to_epoch_seconds(timestamps):
+    """Converts Moralis ISO block timestamps to an int64 array of seconds since epoch."""
+    cleaned = [t.rstrip("Z") if t else "NaT" for t in timestamps]
+    return np.array(cleaned, dtype="datetime64[s]").astype(np.int64)
+
+def _window_bound(value, end_of_day=False):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.rstrip("Z")
+    seconds = int(np.datetime64(value, "s").astype(np.int64))
+    # A plain date as the end of the window includes that whole day
+    if end_of_day and isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        seconds += 86399
+    return seconds
+
+def _valuation_time(end):
+    # Open positions are valued at the end of the window, or now if it has none or has not ended yet
+    now = int(time.time())
+    return now if end is None else min(end, now)
+
+
+class PriceHistory:
+    """Historical USD prices per token, looked up by timestamp in bulk.
+
+    One instance is shared by every app session, so changes and saves are locked.
+    """
+
+    def __init__(self, path=PRICE_HISTORY_PATH):
+        self.path = path
+        self._series = {}  # token address -> (sorted times, prices)
+        self._lock = threading.RLock()
+        if path and os.path.exists(path):
+            self.load(path)
+
+    def __contains__(self, token_address):
+        return token_address.lower() in self._series
+
+    def add(self, token_address, times, prices):
+        """Records prices for a token; a later price for the same timestamp replaces an earlier one."""
+        token = token_address.lower()
+        times = np.asarray(times, dtype=np.int64)
+        prices = np.asarray(prices, dtype=np.float64)
+        with self._lock:
+            if token in self._series:
+                old_times, old_prices = self._series[token]
+                times = np.concatenate([old_times, times])
+                prices = np.concatenate([old_prices, prices])
+
+            order = np.argsort(times, kind="stable")
+            times, prices = times[order], prices[order]
+            keep = np.append(times[1:] != times[:-1], True)
+            self._series[token] = (times[keep], prices[keep])
+
+    def prices_at(self, token_address, times):
+        """Returns the last known price at or before each timestamp, NaN where none is known."""
+        times = np.asarray(times, dtype=np.int64)
+        prices = np.full(len(times), np.nan)
+        series = self._series.get(token_address.lower())
+        if series is None:
+            return prices
+        series_times, series_prices = series
+        idx = np.searchsorted(series_times, times, side="right") - 1
+        known = idx >= 0
+        prices[known] = series_prices[idx[known]]
+        return prices
+
+    def price_at(self, token_address, block_timestamp):
+        """Returns the last known price at a Moralis block timestamp, or None; usable as a FlowGraph price_lookup."""
+        if not token_address or not block_timestamp:
+            return None
+        price = self.prices_at(token_address, to_epoch_seconds([block_timestamp]))[0]
+        return None if np.isnan(price) else float(price)
+
+    def missing(self, token_address, times, max_age=0):
+        """Returns a mask of the timestamps with no price recorded in the max_age seconds before them.
+
+        With the default max_age of 0 only a price recorded at exactly that time counts.
+        """
+        times = np.asarray(times, dtype=np.int64)
+        series = self._series.get(token_address.lower())
+        if series is None:
+            return np.ones(len(times), dtype=bool)
+        series_times = series[0]
+        idx = np.searchsorted(series_times, times, side="right") - 1
+        missing = idx < 0
+        known = ~missing
+        missing[known] = times[known] - series_times[idx[known]] > max_age
+        return missing
+
+    def save(self, path=None):
+        """Writes the history to a temporary file and swaps it in, so a crash never leaves a partial file."""
+        path = path or self.path
+        with self._lock:
+            series = self._series
+            tokens = list(series)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    tokens=np.array(tokens, dtype=str),
+                    counts=np.array([len(series[t][0]) for t in tokens], dtype=np.int64),
+                    times=np.concatenate([series[t][0] for t in tokens]) if tokens else np.array([], dtype=np.int64),
+                    prices=np.concatenate([series[t][1] for t in tokens]) if tokens else np.array([]),
+                )
+            os.replace(tmp_path, path)
+
+    def load(self, path=None):
+        path = path or self.path
+        with self._lock, np.load(path) as data:
+            offsets = np.concatenate([[0], np.cumsum(data["counts"])])
+            times, prices = data["times"], data["prices"]
+            for i, token in enumerate(data["tokens"].tolist()):
+                self._series[token] = (times[offsets[i]:offsets[i + 1]], prices[offsets[i]:offsets[i + 1]])
+
+
+def _call(fetcher, *args):
+    return fetcher(*args)
+
+def backfill_prices(transfers_by_wallet, price_history, chain, api_key, max_age=0, to_date=None, value_holdings=True,
+                    fetch=_call):
+    """Fetches prices only for the transfers price_history cannot price yet, then saves it.
+
+    By default each transfer is priced at its own block, once; a run over transfers
+    that are all priced makes no API calls. A max_age above 0 trades accuracy for
+    fewer lookups: a price fetched at the earliest unpriced transfer then also covers
+    the transfers in the max_age seconds after it. With value_holdings, tokens a
+    wallet still holds at to_date are also priced at to_date, or at the latest
+    price without one, so compute_wallet_pnl can value them. Lookups are sent in
+    batches through get_token_prices, called as fetch(fetcher, *args); the app
+    passes one that runs them on the fetch workers. Returns the number of prices fetched.
+    """
+    needed = {}
+    for transfers in transfers_by_wallet.values():
+        for transfer in transfers or []:
+            token = (transfer.get("address") or "").lower()
+            if token and transfer.get("block_timestamp"):
+                needed.setdefault(token, []).append(transfer)
+
+    lookups = []  # (token, block number, time the price is recorded at)
+    for token, transfers in needed.items():
+        times = to_epoch_seconds([t["block_timestamp"] for t in transfers])
+        missing = price_history.missing(token, times, max_age)
+        # Moralis lists transfers newest first; walk them oldest first
+        unpriced = sorted(
+            (time_s, transfer.get("block_number"))
+            for transfer, time_s, is_missing in zip(transfers, times.tolist(), missing.tolist())
+            if is_missing
+        )
+
+        covered_until = None
+        for time_s, block_number in unpriced:
+            if covered_until is not None and time_s <= covered_until:
+                continue
+            lookups.append((token, block_number, time_s))
+            covered_until = time_s + max_age
+
+    fetched = 0
+    try:
+        fetched += _fetch_prices(lookups, price_history, chain, api_key, fetch)
+        if value_holdings:
+            fetched += _backfill_valuation_prices(transfers_by_wallet, price_history, chain, api_key, to_date, fetch)
+    finally:
+        # Keep what was fetched even if a later lookup raised, e.g. while it waits on a worker
+        if fetched and price_history.path:
+            price_history.save()
+    return fetched
+
+def _fetch_prices(lookups, price_history, chain, api_key, fetch):
+    if not lookups:
+        return 0
+    prices = fetch(get_token_prices, [[token, block_number] for token, block_number, _ in lookups], chain, api_key)
+    fetched = 0
+    for (token, _, time_s), price in zip(lookups, prices or []):
+        if price is not None:
+            price_history.add(token, [time_s], [price])
+            fetched += 1
+    return fetched
+
+def _backfill_valuation_prices(transfers_by_wallet, price_history, chain, api_key, to_date, fetch):
+    end = _window_bound(to_date, end_of_day=True)
+    valuation_time = _valuation_time(end)
+    held = {
+        pnl["token_address"]
+        for token_pnl in compute_wallet_pnl(transfers_by_wallet, price_history, to_date=to_date).values()
+        for pnl in token_pnl if pnl["remaining_tokens"] > 0
+    }
+    unvalued = [token for token in sorted(held) if price_history.missing(token, [valuation_time], VALUATION_MAX_AGE)[0]]
+    if not unvalued:
+        return 0
+
+    block_number = None
+    if valuation_time < int(time.time()) - VALUATION_MAX_AGE:
+        date = datetime.datetime.fromtimestamp(valuation_time, datetime.timezone.utc).isoformat()
+        block_number = fetch(get_block_at_date, date, chain, api_key)
+        if block_number is None:
+            return 0
+    return _fetch_prices([(token, block_number, valuation_time) for token in unvalued], price_history, chain, api_key,
+                         fetch)
+
+def _token_amount(transfer):
+    amount = transfer.get("value_with_decimals")
+    if amount is None:
+        amount = transfer.get("value", 0)
+    try:
+        return float(amount)
+    except (ValueError, TypeError):
+        return 0.0
+
+def _known(value):
+    # NaN marks a figure that depends on a transfer with no known price
+    return None if math.isnan(value) else value
+
+def _total(values):
+    values = list(values)
+    return None if any(v is None for v in values) else sum(values)
+
+def drop_dust(transfers, price_history, min_usd_value, max_age=VALUATION_MAX_AGE):
+    """Returns the transfers worth at least min_usd_value at their block time.
+
+    A transfer is valued with the last price price_history holds from the max_age
+    seconds before it; transfers it cannot price that way are kept.
+    """
+    if not transfers or not min_usd_value:
+        return transfers
+    values = {}
+    by_token = {}
+    for i, transfer in enumerate(transfers):
+        token = (transfer.get("address") or "").lower()
+        if token and transfer.get("block_timestamp"):
+            by_token.setdefault(token, []).append(i)
+    for token, rows in by_token.items():
+        times = to_epoch_seconds([transfers[i]["block_timestamp"] for i in rows])
+        prices = price_history.prices_at(token, times)
+        prices[price_history.missing(token, times, max_age)] = np.nan
+        for i, price in zip(rows, prices.tolist()):
+            if not math.isnan(price):
+                values[i] = _token_amount(transfers[i]) * price
+    return [transfer for i, transfer in enumerate(transfers) if values.get(i, min_usd_value) >= min_usd_value]
+
+def compute_wallet_pnl(transfers_by_wallet, price_history, from_date=None, to_date=None):
+    """Computes FIFO cost-basis PnL per token for many wallets from ERC20 transfer rows.
+
+    transfers_by_wallet maps a wallet address to rows from get_erc20_token_transfers.
+    Incoming transfers count as buys and outgoing transfers as sells, priced from
+    price_history at their block time. Transfers before from_date still build the
+    cost basis; only buys and sells inside the window are reported. Sold quantity
+    with no matching buy lot is left out of the realized profit. USD figures that
+    depend on a transfer price_history cannot price are None, and unpriced_trades
+    counts those transfers; run backfill_prices first to fill them in. Tokens
+    still held are valued at to_date, or now without one, with a price no older
+    than VALUATION_MAX_AGE; without such a price unrealized_profit_usd is None.
+
+    Returns {wallet: [pnl dict per token]} with the fields of get_wallet_pnl_breakdown
+    plus unrealized_profit_usd and remaining_tokens.
+    """
+    start = _window_bound(from_date)
+    end = _window_bound(to_date, end_of_day=True)
+
+    wallets, tokens, timestamps, quantities = [], [], [], []
+    token_info = {}
+    for wallet, transfers in transfers_by_wallet.items():
+        wallet = wallet.lower()
+        for transfer in transfers or []:
+            token = (transfer.get("address") or "").lower()
+            to_address = (transfer.get("to_address") or "").lower()
+            from_address = (transfer.get("from_address") or "").lower()
+            if not token or to_address == from_address:
+                continue
+            if to_address == wallet:
+                sign = 1.0
+            elif from_address == wallet:
+                sign = -1.0
+            else:
+                continue
+
+            wallets.append(wallet)
+            tokens.append(token)
+            timestamps.append(transfer.get("block_timestamp"))
+            quantities.append(sign * _token_amount(transfer))
+            if token not in token_info:
+                token_info[token] = {
+                    "name": transfer.get("token_name"),
+                    "symbol": transfer.get("token_symbol"),
+                    "possible_spam": transfer.get("possible_spam"),
+                }
+
+    if not quantities:
+        return {wallet.lower(): [] for wallet in transfers_by_wallet}
+
+    wallet_names, wallet_codes = np.unique(np.array(wallets), return_inverse=True)
+    token_names, token_codes = np.unique(np.array(tokens), return_inverse=True)
+    times = to_epoch_seconds(timestamps)
+    qty = np.array(quantities)
+
+    # One group per (wallet, token) pair
+    group_keys, groups = np.unique(wallet_codes * len(token_names) + token_codes, return_inverse=True)
+    n_groups = len(group_keys)
+
+    prices = np.zeros(len(qty))
+    for code, token in enumerate(token_names.tolist()):
+        rows = token_codes == code
+        prices[rows] = price_history.prices_at(token, times[rows])
+    # Rows without a price stay NaN, so every figure that depends on them comes out as None
+    unpriced = np.isnan(prices)
+
+    up_to_end = np.ones(len(qty), dtype=bool) if end is None else times <= end
+    in_window = up_to_end if start is None else up_to_end & (times >= start)
+    buys = (qty > 0) & in_window
+    sells = (qty < 0) & in_window
+    usd = np.abs(qty) * prices
+
+    tokens_bought = np.bincount(groups, weights=np.where(buys, qty, 0.0), minlength=n_groups)
+    tokens_sold = np.bincount(groups, weights=np.where(sells, -qty, 0.0), minlength=n_groups)
+    bought_usd = np.bincount(groups, weights=np.where(buys, usd, 0.0), minlength=n_groups)
+    sold_usd = np.bincount(groups, weights=np.where(sells, usd, 0.0), minlength=n_groups)
+    unpriced_counts = np.bincount(groups, weights=unpriced & up_to_end, minlength=n_groups).astype(int)
+    buy_counts = np.bincount(groups, weights=buys, minlength=n_groups).astype(int)
+    sell_counts = np.bincount(groups, weights=sells, minlength=n_groups).astype(int)
+
+    # FIFO lot matching is sequential within a group, so it walks rows in (group, time) order
+    realized = np.zeros(n_groups)
+    cost_sold = np.zeros(n_groups)
+    matched_sold = np.zeros(n_groups)
+    remaining = np.zeros(n_groups)
+    remaining_cost = np.zeros(n_groups)
+
+    order = np.lexsort((times, groups))
+    order = order[up_to_end[order]]
+    lots = deque()
+    current = -1
+    for group, amount, price, counted in zip(groups[order].tolist(), qty[order].tolist(),
+                                             prices[order].tolist(), in_window[order].tolist()):
+        if group != current:
+            if current >= 0:
+                remaining[current] = sum(lot[0] for lot in lots)
+                remaining_cost[current] = sum(lot[0] * lot[1] for lot in lots)
+            lots = deque()
+            current = group
+
+        if amount > 0:
+            lots.append([amount, price])
+            continue
+
+        to_sell = -amount
+        while to_sell > 0 and lots:
+            lot = lots[0]
+            matched = min(lot[0], to_sell)
+            if counted:
+                realized[group] += matched * (price - lot[1])
+                cost_sold[group] += matched * lot[1]
+                matched_sold[group] += matched
+            lot[0] -= matched
+            to_sell -= matched
+            if lot[0] <= 0:
+                lots.popleft()
+    if current >= 0:
+        remaining[current] = sum(lot[0] for lot in lots)
+        remaining_cost[current] = sum(lot[0] * lot[1] for lot in lots)
+
+    # A held token with no recent price at the valuation time has unknown unrealized PnL
+    valuation_time = _valuation_time(end)
+    end_prices = np.array([
+        np.nan if price_history.missing(token, [valuation_time], VALUATION_MAX_AGE)[0]
+        else price_history.prices_at(token, [valuation_time])[0]
+        for token in token_names.tolist()
+    ])
+
+    # Plain Python values from here on, so results format and pickle like API responses
+    (tokens_bought, tokens_sold, bought_usd, sold_usd, buy_counts, sell_counts, unpriced_counts, realized,
+     cost_sold, matched_sold, remaining, remaining_cost, end_prices) = (
+        a.tolist() for a in (tokens_bought, tokens_sold, bought_usd, sold_usd, buy_counts, sell_counts,
+                             unpriced_counts, realized, cost_sold, matched_sold, remaining, remaining_cost,
+                             end_prices))
+    wallet_names = wallet_names.tolist()
+    token_names = token_names.tolist()
+
+    results = {wallet.lower(): [] for wallet in transfers_by_wallet}
+    for g, key in enumerate(group_keys.tolist()):
+        if buy_counts[g] + sell_counts[g] == 0 and remaining[g] <= 0:
+            continue
+        wallet = wallet_names[key // len(token_names)]
+        token_code = key % len(token_names)
+        token = token_names[token_code]
+        results[wallet].append({
+            "token_address": token,
+            "total_trade_volume": _known(bought_usd[g] + sold_usd[g]),
+            "total_realized_profit_usd": _known(realized[g]),
+            "total_realized_profit_percentage": _known(realized[g] / cost_sold[g] * 100) if cost_sold[g] > 0 else None,
+            "total_sold_volume_usd": _known(sold_usd[g]),
+            "total_bought_volume_usd": _known(bought_usd[g]),
+            "avg_buy_price_usd": _known(bought_usd[g] / tokens_bought[g]) if tokens_bought[g] > 0 else 0,
+            "avg_sell_price_usd": _known(sold_usd[g] / tokens_sold[g]) if tokens_sold[g] > 0 else 0,
+            "total_tokens_bought": tokens_bought[g],
+            "total_tokens_sold": tokens_sold[g],
+            "avg_cost_of_quantity_sold": _known(cost_sold[g] / matched_sold[g]) if matched_sold[g] > 0 else 0,
+            "cost_of_quantity_sold_usd": _known(cost_sold[g]),
+            "count_of_trades": buy_counts[g] + sell_counts[g],
+            "total_buys": buy_counts[g],
+            "total_sells": sell_counts[g],
+            "unpriced_trades": unpriced_counts[g],
+            "unrealized_profit_usd": _known(remaining[g] * end_prices[token_code] - remaining_cost[g])
+            if remaining[g] > 0 else 0.0,
+            "remaining_tokens": remaining[g],
+            **token_info[token],
+        })
+    return results
+
+def summarize_pnl(token_pnl):
+    """Rolls per-token results up into the fields of get_wallet_pnl; a total is None if any part of it is."""
+    realized = _total(p["total_realized_profit_usd"] for p in token_pnl)
+    cost_sold = _total(p["cost_of_quantity_sold_usd"] for p in token_pnl)
+    return {
+        "total_count_of_trades": sum(p["count_of_trades"] for p in token_pnl),
+        "total_trade_volume": _total(p["total_trade_volume"] for p in token_pnl),
+        "total_realized_profit_usd": realized,
+        "total_realized_profit_percentage": realized / cost_sold * 100
+        if realized is not None and cost_sold else None,
+        "total_sold_volume_usd": _total(p["total_sold_volume_usd"] for p in token_pnl),
+        "total_bought_volume_usd": _total(p["total_bought_volume_usd"] for p in token_pnl),
+        "total_unrealized_profit_usd": _total(p["unrealized_profit_usd"] for p in token_pnl),
+        "total_unpriced_trades": sum(p["unpriced_trades"] for p in token_pnl),
+    }
@@ -0,0 +1,201 @@
+import inspect
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import wraps
+
+from cachetools import LRUCache
+
+from key_pool import KeyPool
+
+# A call is hedged once it runs longer than its endpoint's p95, measured over recent successes
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.05
+REQUEST_TIMEOUT = 30
+
+# Consecutive failures that open an endpoint's circuit, and how long it stays open
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+
+_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="moralis-fetch")
+_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies for one endpoint."""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def p95(self):
+        with self._lock:
+            if len(self._samples) < HEDGE_MIN_SAMPLES:
+                return None
+            samples = sorted(self._samples)
+        return samples[int(len(samples) * 0.95) - 1]
+
+
+class CircuitBreaker:
+    """Fails fast while an endpoint keeps failing, then lets one trial call through."""
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+_latencies = {}  # endpoint -> LatencyTracker
+_breakers = {}   # (endpoint, chain) -> CircuitBreaker
+
+def get_latency_tracker(endpoint):
+    with _lock:
+        if endpoint not in _latencies:
+            _latencies[endpoint] = LatencyTracker()
+        return _latencies[endpoint]
+
+def get_circuit_breaker(endpoint, chain):
+    with _lock:
+        if (endpoint, chain) not in _breakers:
+            _breakers[(endpoint, chain)] = CircuitBreaker()
+        return _breakers[(endpoint, chain)]
+
+def _is_client_error(error):
+    # A bad address or parameter is not a sign that Moralis is degraded
+    status = getattr(error, "status", None)
+    return isinstance(status, int) and 400 <= status < 500 and status != 429
+
+def _call(endpoint, func, kwargs):
+    api_key = kwargs.get("api_key")
+    if isinstance(api_key, KeyPool):
+        return api_key.call(endpoint, func, **kwargs)
+    return func(**kwargs)
+
+def call_endpoint(endpoint, chain, func, **kwargs):
+    """Calls func(**kwargs) behind the endpoint's circuit breaker, hedging slow calls.
+
+    If the call has not answered after the endpoint's p95 latency, a duplicate is
+    sent and whichever succeeds first wins. A losing call is left to finish in the
+    background. When api_key is a KeyPool, each call draws its own key from the
+    pool. Raises CircuitOpenError without calling func while the circuit for
+    (endpoint, chain) is open.
+    """
+    breaker = get_circuit_breaker(endpoint, chain)
+    if not breaker.allow():
+        raise CircuitOpenError(f"{endpoint} on {chain} is failing, skipping the call")
+
+    tracker = get_latency_tracker(endpoint)
+    hedge_delay = tracker.p95()
+    hedged = hedge_delay is None
+    start = time.monotonic()
+    deadline = start + REQUEST_TIMEOUT
+    pending = {_executor.submit(_call, endpoint, func, kwargs)}
+    error = None
+
+    while pending:
+        remaining = max(0.0, deadline - time.monotonic())
+        timeout = remaining if hedged else min(remaining, max(hedge_delay, HEDGE_MIN_DELAY))
+        done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            if future.exception() is None:
+                tracker.record(time.monotonic() - start)
+                breaker.record_success()
+                return future.result()
+            error = future.exception()
+
+        if not done:
+            if hedged:
+                error = TimeoutError(f"{endpoint} did not answer within {REQUEST_TIMEOUT}s")
+                break
+            print(f"Hedging slow {endpoint} call after {hedge_delay:.2f}s")
+            pending.add(_executor.submit(_call, endpoint, func, kwargs))
+            hedged = True
+
+    if error is not None and _is_client_error(error):
+        breaker.record_success()
+    else:
+        breaker.record_failure()
+    raise error
+
+
+# Last successful payload per fetcher and arguments, served when a fresh fetch fails
+_last_good = LRUCache(maxsize=1000)
+_stale_since = {}  # key -> time the stale payload was saved, while it is being served
+
+def _payload_key(func, args, kwargs):
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    # Payloads are shared across the key pool, whichever key fetched them
+    return (func.__name__,) + tuple(item for item in bound.arguments.items() if item[0] != "api_key")
+
+def last_known_good(func):
+    """Makes a fetcher return its last good payload instead of None when a fetch fails."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        key = _payload_key(func, args, kwargs)
+        result = func(*args, **kwargs)
+        with _lock:
+            if result is not None:
+                _last_good[key] = (time.time(), result)
+                _stale_since.pop(key, None)
+                return result
+            saved = _last_good.get(key)
+            if saved is None:
+                return None
+            _stale_since[key] = saved[0]
+        print(f"Serving {func.__name__} from {time.time() - saved[0]:.0f}s ago")
+        return saved[1]
+    return wrapper
+
+def payload_age(func, *args, **kwargs):
+    """Returns how old in seconds the payload last returned for these arguments is, or None if it was fresh."""
+    func = inspect.unwrap(func)
+    key = _payload_key(func, args, kwargs)
+    with _lock:
+        saved_at = _stale_since.get(key)
+    return None if saved_at is None else time.time() - saved_at
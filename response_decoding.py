@@ -0,0 +1,91 @@
+import functools
+import json
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+    print("Warning: ijson is not installed; paged Moralis responses will be decoded whole instead of streamed. "
+          "Install it with: pip install ijson")
+
+from sdk_clients import request
+
+# Fields kept from each row of a paged EVM response; rows come back as tuples in this order
+ROW_FIELDS = {
+    "get_wallet_transactions": (
+        "hash", "from_address", "to_address", "value", "gas", "gas_price", "block_timestamp",
+    ),
+    "get_wallet_nft_transfers": (
+        "block_number", "transaction_hash", "from_address", "to_address", "token_address",
+        "token_id", "amount", "possible_spam", "verified_contract", "block_timestamp",
+    ),
+    "get_wallet_nfts": (
+        "name", "symbol", "token_address", "token_id", "amount", "contract_type",
+        "token_uri", "metadata", "possible_spam", "verified_collection",
+    ),
+    "get_wallet_token_transfers": (
+        "transaction_hash", "token_name", "token_symbol", "address", "possible_spam",
+        "verified_contract", "to_address", "from_address", "value", "value_decimal",
+        "token_decimals", "block_number", "log_index", "block_timestamp",
+    ),
+}
+
+# Top-level fields of a paged response that are kept alongside its rows
+PAGE_FIELDS = ("cursor", "page", "page_size")
+
+_SCALAR_EVENTS = ("string", "number", "boolean", "null")
+
+
+def decode_page(body, fields):
+    """Decodes a paged response body into {"result": [row tuples], ...page fields}.
+
+    With ijson installed the body is parsed incrementally and only the declared
+    fields are ever turned into Python values; nested objects such as normalized
+    metadata or media are skipped without being built. Without ijson the body
+    is decoded whole and then projected.
+    """
+    if ijson is None:
+        data = json.load(body)
+        page = {key: data.get(key) for key in PAGE_FIELDS}
+        page["result"] = [tuple(item.get(field) for field in fields) for item in data.get("result") or []]
+        return page
+
+    positions = {f"result.item.{field}": i for i, field in enumerate(fields)}
+    page_prefixes = set(PAGE_FIELDS)
+    page = {key: None for key in PAGE_FIELDS}
+    rows = []
+    row = None
+    for prefix, event, value in ijson.parse(body, use_float=True):
+        if prefix == "result.item":
+            if event == "start_map":
+                row = [None] * len(fields)
+            elif event == "end_map":
+                rows.append(tuple(row))
+                row = None
+        elif row is not None:
+            i = positions.get(prefix)
+            if i is not None and event in _SCALAR_EVENTS:
+                row[i] = value
+        elif prefix in page_prefixes and event in _SCALAR_EVENTS:
+            page[prefix] = value
+    page["result"] = rows
+    return page
+
+@functools.lru_cache(maxsize=None)
+def projected(endpoint_func):
+    """Wraps an SDK endpoint function so its response is streamed through decode_page.
+
+    The wrapper takes the same api_key and params as the SDK function, so it can be
+    passed to call_endpoint in its place. The endpoint's fields come from ROW_FIELDS.
+    """
+    fields = ROW_FIELDS[endpoint_func.__name__]
+
+    def call(api_key, params):
+        response = request(endpoint_func, api_key, params, stream=True).response
+        try:
+            return decode_page(response, fields)
+        finally:
+            response.release_conn()
+
+    call.__name__ = endpoint_func.__name__
+    return call
@@ -0,0 +1,74 @@
+import functools
+import importlib
+import json
+import sys
+import threading
+
+from resilience import REQUEST_TIMEOUT
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+
+# The Moralis SDK and its generated OpenAPI clients take a while to import,
+# so they are only loaded when the first request is made
+evm_api = LazyModule("moralis.evm_api")
+sol_api = LazyModule("moralis.sol_api")
+
+
+@functools.lru_cache(maxsize=None)
+def get_api_instance(module_name, api_key):
+    """Returns one SDK API instance per endpoint group and key, so its connection pool is reused.
+
+    The SDK's own endpoint functions build a new client, and with it new
+    connections, on every call.
+    """
+    return sys.modules[module_name].get_api_instance(api_key)
+
+def request(endpoint_func, api_key, params, stream=False, timeout=REQUEST_TIMEOUT, body=None):
+    """Calls an SDK endpoint the way the SDK function does, on a shared API instance, and returns the raw API response.
+
+    The SDK functions set no socket timeout, so a hung connection would hold its
+    fetch thread forever; timeout bounds the whole request in seconds. body is
+    the JSON body of POST endpoints.
+    """
+    module = sys.modules[endpoint_func.__module__]
+    api_instance = get_api_instance(endpoint_func.__module__, api_key)
+    kwargs = {}
+    if hasattr(module, "RequestPathParams"):
+        kwargs["path_params"] = {k: v for k, v in params.items() if k in module.RequestPathParams.__annotations__}
+    if hasattr(module, "RequestQueryParams"):
+        kwargs["query_params"] = {k: v for k, v in params.items() if k in module.RequestQueryParams.__annotations__}
+    if body is not None:
+        kwargs["body"] = body
+    return getattr(api_instance, endpoint_func.__name__)(
+        **kwargs,
+        accept_content_types=(
+            'application/json; charset=utf-8',
+        ),
+        skip_deserialization=True,
+        stream=stream,
+        timeout=timeout,
+    )
+
+@functools.lru_cache(maxsize=None)
+def shared_client(endpoint_func):
+    """Wraps an SDK endpoint function to run on a shared API instance, taking the same api_key and params."""
+    def call(api_key, params, body=None):
+        return json.loads(request(endpoint_func, api_key, params, body=body).response.data)
+
+    call.__name__ = endpoint_func.__name__
+    return call
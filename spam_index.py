@@ -0,0 +1,132 @@
+import hashlib
+import math
+import os
+import struct
+import threading
+
+SPAM_INDEX_PATH = "spam_index.bin"
+_HEADER = struct.Struct("<QQQ")  # bit count, hash count, byte offset of the address list
+
+
+class SpamIndex:
+    """Persistent set of known spam contract addresses.
+
+    A Bloom filter answers most lookups, which are for legitimate contracts, without
+    touching the exact address list; the list is only read from disk the first time
+    the filter reports a possible match, so false positives never drop a real row.
+    """
+
+    def __init__(self, path=SPAM_INDEX_PATH, capacity=1_000_000, error_rate=0.001):
+        self.path = path
+        self.bit_count = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self._bits = bytearray((self.bit_count + 7) // 8)
+        self._exact = None
+        self._list_offset = None
+        self._added = set()
+        self._removed = set()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load_filter()
+        else:
+            self._exact = set()
+
+    def _positions(self, address):
+        digest = hashlib.blake2b(address.lower().encode(), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        return [(h1 + i * h2) % self.bit_count for i in range(self.hash_count)]
+
+    def _maybe_contains(self, address):
+        return all(self._bits[p >> 3] & (1 << (p & 7)) for p in self._positions(address))
+
+    def _exact_set(self):
+        if self._exact is None:
+            with open(self.path, "rb") as f:
+                f.seek(self._list_offset)
+                self._exact = set(f.read().decode().split())
+        return self._exact
+
+    def __contains__(self, address):
+        if not address or not self._maybe_contains(address):
+            return False
+        with self._lock:
+            return address.lower() in self._exact_set()
+
+    def add(self, address):
+        """Records a spam contract; returns True if it was not known yet."""
+        if not address:
+            return False
+        address = address.lower()
+        with self._lock:
+            if self._maybe_contains(address) and address in self._exact_set():
+                return False
+            self._set_bits(address)
+            self._exact_set().add(address)
+            self._added.add(address)
+            self._removed.discard(address)
+            return True
+
+    def remove(self, address):
+        """Forgets a contract that is no longer flagged as spam; returns True if it was known.
+
+        A Bloom filter cannot clear bits, so lookups rely on the exact list until
+        save rebuilds the filter without the address.
+        """
+        if not address:
+            return False
+        address = address.lower()
+        with self._lock:
+            if not self._maybe_contains(address) or address not in self._exact_set():
+                return False
+            self._exact.discard(address)
+            self._added.discard(address)
+            self._removed.add(address)
+            return True
+
+    def _set_bits(self, address):
+        for p in self._positions(address):
+            self._bits[p >> 3] |= 1 << (p & 7)
+
+    def _load_filter(self):
+        with open(self.path, "rb") as f:
+            self.bit_count, self.hash_count, self._list_offset = _HEADER.unpack(f.read(_HEADER.size))
+            self._bits = bytearray(f.read(self._list_offset - _HEADER.size))
+
+    def save(self):
+        """Writes the index if anything changed, merging entries saved by other processes meanwhile.
+
+        Addresses removed here stay removed even if another process saved them.
+        """
+        with self._lock:
+            if not self._added and not self._removed:
+                return
+            if os.path.exists(self.path):
+                on_disk = SpamIndex(self.path)
+                for address in on_disk._exact_set() - self._exact_set() - self._removed:
+                    self._set_bits(address)
+                    self._exact.add(address)
+            if self._removed:
+                self._bits = bytearray(len(self._bits))
+                for address in self._exact:
+                    self._set_bits(address)
+
+            list_offset = _HEADER.size + len(self._bits)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(_HEADER.pack(self.bit_count, self.hash_count, list_offset))
+                f.write(self._bits)
+                f.write("\n".join(sorted(self._exact)).encode())
+            os.replace(tmp_path, self.path)
+            self._list_offset = list_offset
+            self._added.clear()
+            self._removed.clear()
+
+
+_spam_index = None
+
+def get_spam_index():
+    """Returns the process-wide spam index, loading it on first use."""
+    global _spam_index
+    if _spam_index is None:
+        _spam_index = SpamIndex()
+    return _spam_index
@@ -0,0 +1,178 @@
+import pnl_engine
+from pnl_engine import PriceHistory, backfill_prices, compute_wallet_pnl, summarize_pnl
+
+WALLET = "0x000000000000000000000000000000000000aaaa"
+OTHER = "0x000000000000000000000000000000000000bbbb"
+TOKEN = "0x000000000000000000000000000000000000cccc"
+
+
+def transfer(timestamp, amount, incoming, block_number=None):
+    return {
+        "address": TOKEN,
+        "token_name": "Test",
+        "token_symbol": "TST",
+        "to_address": WALLET if incoming else OTHER,
+        "from_address": OTHER if incoming else WALLET,
+        "value_with_decimals": str(amount),
+        "block_timestamp": timestamp,
+        "block_number": block_number,
+    }
+
+def stub_prices(monkeypatch, prices_by_block):
+    calls = []
+
+    def get_token_prices(tokens, chain, api_key):
+        calls.extend(to_block for _, to_block in tokens)
+        return [prices_by_block[to_block] for _, to_block in tokens]
+
+    monkeypatch.setattr(pnl_engine, "get_token_prices", get_token_prices)
+    return calls
+
+def test_same_day_buy_and_sell_are_priced_at_their_own_blocks(monkeypatch):
+    # Rows arrive newest first, as Moralis lists them
+    transfers = {WALLET: [
+        transfer("2024-01-01T18:00:00.000Z", 10, incoming=False, block_number=2),
+        transfer("2024-01-01T09:00:00.000Z", 10, incoming=True, block_number=1),
+    ]}
+    calls = stub_prices(monkeypatch, {1: 1.0, 2: 2.0})
+    history = PriceHistory(path=None)
+
+    assert backfill_prices(transfers, history, "eth", None) == 2
+    [pnl] = compute_wallet_pnl(transfers, history)[WALLET]
+    assert pnl["total_bought_volume_usd"] == 10
+    assert pnl["total_sold_volume_usd"] == 20
+    assert pnl["total_realized_profit_usd"] == 10
+    assert pnl["total_realized_profit_percentage"] == 100
+    assert pnl["unpriced_trades"] == 0
+
+    assert backfill_prices(transfers, history, "eth", None) == 0
+    assert len(calls) == 2
+
+def test_max_age_prices_from_the_earliest_unpriced_transfer(monkeypatch):
+    transfers = {WALLET: [
+        transfer("2024-01-01T18:00:00.000Z", 10, incoming=False, block_number=2),
+        transfer("2024-01-01T09:00:00.000Z", 10, incoming=True, block_number=1),
+    ]}
+    calls = stub_prices(monkeypatch, {1: 1.0, 2: 2.0})
+    history = PriceHistory(path=None)
+
+    assert backfill_prices(transfers, history, "eth", None, max_age=86400) == 1
+    assert calls == [1]
+    [pnl] = compute_wallet_pnl(transfers, history)[WALLET]
+    assert pnl["total_bought_volume_usd"] == 10
+    assert pnl["unpriced_trades"] == 0
+
+def test_lookups_for_all_tokens_go_out_in_one_batch(monkeypatch):
+    batches = []
+
+    def get_token_prices(tokens, chain, api_key):
+        batches.append(tokens)
+        return [1.0] * len(tokens)
+
+    monkeypatch.setattr(pnl_engine, "get_token_prices", get_token_prices)
+    transfers = {WALLET: [
+        {**transfer(f"2024-01-0{day}T00:00:00.000Z", 1, incoming=False, block_number=day), "address": f"0x{day:040x}"}
+        for day in range(1, 6)
+    ]}
+    history = PriceHistory(path=None)
+
+    assert backfill_prices(transfers, history, "eth", None) == 5
+    assert len(batches) == 1
+    assert sorted(batches[0]) == [[f"0x{day:040x}", day] for day in range(1, 6)]
+
+def test_fifo_matches_sells_against_oldest_lots():
+    history = PriceHistory(path=None)
+    history.add(TOKEN, pnl_engine.to_epoch_seconds([
+        "2024-01-01T00:00:00Z", "2024-01-02T00:00:00Z", "2024-01-03T00:00:00Z",
+    ]), [1.0, 3.0, 4.0])
+    transfers = {WALLET: [
+        transfer("2024-01-03T00:00:00Z", 15, incoming=False),
+        transfer("2024-01-02T00:00:00Z", 10, incoming=True),
+        transfer("2024-01-01T00:00:00Z", 10, incoming=True),
+    ]}
+
+    [pnl] = compute_wallet_pnl(transfers, history, to_date="2024-01-03")[WALLET]
+    # 10 from the first lot at $1 and 5 from the second at $3, all sold at $4
+    assert pnl["cost_of_quantity_sold_usd"] == 25
+    assert pnl["total_realized_profit_usd"] == 35
+    assert pnl["remaining_tokens"] == 5
+    assert pnl["unrealized_profit_usd"] == 5
+    assert pnl["total_buys"] == 2
+    assert pnl["total_sells"] == 1
+
+def test_held_tokens_are_valued_at_the_window_end(monkeypatch):
+    transfers = {WALLET: [transfer("2024-01-01T09:00:00.000Z", 10, incoming=True, block_number=1)]}
+    history = PriceHistory(path=None)
+    # No price at the end of the window yet, so the position cannot be valued
+    history.add(TOKEN, pnl_engine.to_epoch_seconds(["2024-01-01T09:00:00Z"]), [1.0])
+    [pnl] = compute_wallet_pnl(transfers, history, to_date="2025-01-01")[WALLET]
+    assert pnl["unrealized_profit_usd"] is None
+
+    calls = stub_prices(monkeypatch, {500: 3.0, None: 5.0})
+    monkeypatch.setattr(pnl_engine, "get_block_at_date", lambda date, chain, api_key: 500)
+    assert backfill_prices(transfers, history, "eth", None, to_date="2025-01-01") == 1
+    assert calls == [500]
+    [pnl] = compute_wallet_pnl(transfers, history, to_date="2025-01-01")[WALLET]
+    assert pnl["remaining_tokens"] == 10
+    assert pnl["unrealized_profit_usd"] == 20
+
+    # Without a window end the position is valued at the latest price
+    assert backfill_prices(transfers, history, "eth", None) == 1
+    assert calls == [500, None]
+    [pnl] = compute_wallet_pnl(transfers, history)[WALLET]
+    assert pnl["unrealized_profit_usd"] == 40
+
+def test_window_keeps_cost_basis_of_earlier_buys():
+    history = PriceHistory(path=None)
+    history.add(TOKEN, pnl_engine.to_epoch_seconds([
+        "2024-01-01T00:00:00Z", "2024-02-01T00:00:00Z",
+    ]), [1.0, 5.0])
+    transfers = {WALLET: [
+        transfer("2024-02-01T00:00:00Z", 10, incoming=False),
+        transfer("2024-01-01T00:00:00Z", 10, incoming=True),
+    ]}
+
+    [pnl] = compute_wallet_pnl(transfers, history, from_date="2024-01-15")[WALLET]
+    assert pnl["total_buys"] == 0
+    assert pnl["total_sells"] == 1
+    assert pnl["total_bought_volume_usd"] == 0
+    assert pnl["total_realized_profit_usd"] == 40
+
+def test_unpriced_transfers_are_reported_as_unknown():
+    history = PriceHistory(path=None)
+    history.add(TOKEN, pnl_engine.to_epoch_seconds(["2024-01-02T00:00:00Z"]), [2.0])
+    transfers = {WALLET: [
+        transfer("2024-01-02T00:00:00Z", 10, incoming=False),
+        transfer("2024-01-01T00:00:00Z", 10, incoming=True),
+    ]}
+
+    [pnl] = compute_wallet_pnl(transfers, history)[WALLET]
+    assert pnl["unpriced_trades"] == 1
+    assert pnl["total_bought_volume_usd"] is None
+    assert pnl["total_realized_profit_usd"] is None
+    assert pnl["total_sold_volume_usd"] == 20
+
+    summary = summarize_pnl([pnl])
+    assert summary["total_realized_profit_usd"] is None
+    assert summary["total_unpriced_trades"] == 1
+
+def test_price_history_save_and_load(tmp_path):
+    path = str(tmp_path / "prices.npz")
+    history = PriceHistory(path=path)
+    history.add(TOKEN, [100, 200], [1.5, 2.5])
+    history.save()
+
+    loaded = PriceHistory(path=path)
+    assert loaded.prices_at(TOKEN, [200]).tolist() == [2.5]
+    assert list(tmp_path.iterdir()) == [tmp_path / "prices.npz"]
+
+def test_drop_dust_filters_on_usd_and_keeps_unpriced_transfers():
+    history = PriceHistory(path=None)
+    history.add(TOKEN, pnl_engine.to_epoch_seconds(["2024-01-01T00:00:00Z"]), [0.01])
+    small = transfer("2024-01-01T12:00:00Z", 100, incoming=True)
+    large = transfer("2024-01-01T12:00:00Z", 1000, incoming=True)
+    unpriced = {**transfer("2024-01-01T12:00:00Z", 1, incoming=True), "address": OTHER}
+
+    # 100 tokens at $0.01 are worth $1, under the $5 threshold
+    assert pnl_engine.drop_dust([small, large, unpriced], history, 5) == [large, unpriced]
+    assert pnl_engine.drop_dust([small], history, 0) == [small]
@@ -26,4 +26,135 @@ def format_nft_metadata(metadata):
             return ", ".join(f"{k}: {v}" for k, v in metadata_dict.items())
         except json.JSONDecodeError:
             return metadata  # Return as is if not a valid JSON
-    return "N/A"
\ No newline at end of file
+    return "N/A"
+
+def format_amount(value):
+    """Formats a number with two decimals, or N/A when it is unknown (None)."""
+    return f"{float(value):,.2f}" if value is not None else "N/A"
+
+def format_pnl_summary(summary):
+    """Formats a wallet profitability summary as Metric/Value rows."""
+    return [
+        {
+            "Metric": "total_count_of_trades",
+            "Value": f"{float(summary['total_count_of_trades']):,.2f}"
+        },
+        {
+            "Metric": "total_trade_volume",
+            "Value": format_amount(summary.get('total_trade_volume', 0))
+        },
+        {
+            "Metric": "total_realized_profit_usd",
+            "Value": format_amount(summary.get('total_realized_profit_usd', 0))
+        },
+        {
+            "Metric": "Total Realized Profit (%)",
+            "Value": f"{float(summary.get('total_realized_profit_percentage', 0)):,.2f}%" if summary.get('total_realized_profit_percentage') is not None else "N/A"
+        },
+        {
+            "Metric": "total_sold_volume_usd",
+            "Value": format_amount(summary.get('total_sold_volume_usd', 0))
+        },
+        {
+            "Metric": "total_bought_volume_usd",
+            "Value": format_amount(summary.get('total_bought_volume_usd', 0))
+        }
+    ]
+
+def format_pnl_breakdown(pnl):
+    """Formats one token's profitability as Metric/Value rows, token_address first."""
+    rows = [
+        {
+            "Metric": "token_address",
+            "Value": pnl.get("token_address", "N/A")
+        },
+        {
+            "Metric": "total_trade_volume",
+            "Value": format_amount(pnl.get('total_trade_volume', 0))
+        },
+        {
+            "Metric": "total_realized_profit_usd",
+            "Value": format_amount(pnl.get('total_realized_profit_usd', 0))
+        },
+        {
+            "Metric": "Total Realized Profit (%)",
+            "Value": f"{float(pnl.get('total_realized_profit_percentage', 0)):,.2f}%" if pnl.get('total_realized_profit_percentage') is not None else "N/A"
+        },
+        {
+            "Metric": "total_sold_volume_usd",
+            "Value": format_amount(pnl.get('total_sold_volume_usd', 0))
+        },
+        {
+            "Metric": "total_bought_volume_usd",
+            "Value": format_amount(pnl.get('total_bought_volume_usd', 0))
+        },
+        {
+            "Metric": "avg_buy_price_usd",
+            "Value": format_amount(pnl.get('avg_buy_price_usd', 0))
+        },
+        {
+            "Metric": "avg_sell_price_usd",
+            "Value": format_amount(pnl.get('avg_sell_price_usd', 0))
+        },
+        {
+            "Metric": "total_tokens_bought",
+            "Value": format_amount(pnl.get('total_tokens_bought', 0))
+        },
+        {
+            "Metric": "total_tokens_sold",
+            "Value": format_amount(pnl.get('total_tokens_sold', 0))
+        },
+        {
+            "Metric": "avg_cost_of_quantity_sold",
+            "Value": format_amount(pnl.get('avg_cost_of_quantity_sold', 0))
+        },
+        {
+            "Metric": "count_of_trades",
+            "Value": pnl.get("count_of_trades", "N/A")
+        },
+        {
+            "Metric": "total_buys",
+            "Value": pnl.get("total_buys", "N/A")
+        },
+        {
+            "Metric": "total_sells",
+            "Value": pnl.get("total_sells", "N/A")
+        },
+        {
+            "Metric": "name",
+            "Value": pnl.get("name", "N/A")
+        },
+        {
+            "Metric": "symbol",
+            "Value": pnl.get("symbol", "N/A")
+        },
+        {
+            "Metric": "possible_spam",
+            "Value": pnl.get("possible_spam", "N/A")
+        },
+        {
+            "Metric": "verified_contract",
+            "Value": pnl.get("verified_contract", "N/A")
+        },
+        {
+            "Metric": "security_score",
+            "Value": pnl.get("security_score", "N/A")
+        },
+    ]
+
+    # Only the local PnL engine reports unrealized figures
+    if "unrealized_profit_usd" in pnl:
+        rows.append({
+            "Metric": "unrealized_profit_usd",
+            "Value": format_amount(pnl['unrealized_profit_usd'])
+        })
+        rows.append({
+            "Metric": "remaining_tokens",
+            "Value": format_amount(pnl.get('remaining_tokens', 0))
+        })
+    if "unpriced_trades" in pnl:
+        rows.append({
+            "Metric": "unpriced_trades",
+            "Value": pnl["unpriced_trades"]
+        })
+    return rows